@@ -6,7 +6,7 @@ import logging
 import os
 from pathlib import Path
 import typing as ty
-from copy import deepcopy
+from copy import copy, deepcopy
 
 import cloudpickle as cp
 from filelock import SoftFileLock
@@ -30,6 +30,7 @@ from .helpers import (
     create_checksum,
     print_help,
     load_result,
+    result_exists,
     save,
     ensure_list,
     record_error,
@@ -129,20 +130,26 @@ class TaskBase:
         if not self.input_spec:
             raise Exception("No input_spec in class: %s" % self.__class__.__name__)
         klass = make_klass(self.input_spec)
+        fields = attr.fields(klass)
         # todo should be used to input_check in spec??
         self.inputs = klass(
             **{
                 (f.name[1:] if f.name.startswith("_") else f.name): (
                     None if f.default == attr.NOTHING else f.default
                 )
-                for f in attr.fields(klass)
+                for f in fields
             }
         )
         self.input_names = [
             field.name
-            for field in attr.fields(klass)
+            for field in fields
             if field.name not in ["_func", "_graph_checksums"]
         ]
+        # keys of the inputs in the state indices, e.g. "taskname.inputname"
+        self._input_state_keys = {inp: f"{name}.{inp}" for inp in self.input_names}
+        self._state_key_inputs = {
+            key: inp for inp, key in self._input_state_keys.items()
+        }
         # dictionary to save the connections with lazy fields
         self.inp_lf = {}
         self.state = None
@@ -155,12 +162,12 @@ class TaskBase:
         if inputs:
             if isinstance(inputs, dict):
                 inputs = {k: v for k, v in inputs.items() if k in self.input_names}
+            elif isinstance(inputs, str) and inputs in self._input_sets:
+                inputs = self._input_sets[inputs]
             elif Path(inputs).is_file():
                 inputs = json.loads(Path(inputs).read_text())
             elif isinstance(inputs, str):
-                if self._input_sets is None or inputs not in self._input_sets:
-                    raise ValueError("Unknown input set {!r}".format(inputs))
-                inputs = self._input_sets[inputs]
+                raise ValueError("Unknown input set {!r}".format(inputs))
             self.inputs = attr.evolve(self.inputs, **inputs)
             self.inputs.check_metadata()
             self.state_inputs = inputs
@@ -184,20 +191,21 @@ class TaskBase:
 
     def __getstate__(self):
         state = self.__dict__.copy()
+        # the versions of the inputs are only unique within a process
+        state.pop("_checksum_states", None)
         state["input_spec"] = cp.dumps(state["input_spec"])
         state["output_spec"] = cp.dumps(state["output_spec"])
-        inputs = {}
-        for k, v in attr.asdict(state["inputs"]).items():
-            if k.startswith("_"):
-                k = k[1:]
-            inputs[k] = v
-        state["inputs"] = inputs
+        state["inputs"] = state["inputs"].__dict__.copy()
         return state
 
     def __setstate__(self, state):
         state["input_spec"] = cp.loads(state["input_spec"])
         state["output_spec"] = cp.loads(state["output_spec"])
-        state["inputs"] = make_klass(state["input_spec"])(**state["inputs"])
+        klass = make_klass(state["input_spec"])
+        # the values were validated when the inputs were created, no need for __init__
+        inputs = klass.__new__(klass)
+        inputs.__dict__.update(state["inputs"])
+        state["inputs"] = inputs
         self.__dict__.update(state)
 
     def __getattr__(self, name):
@@ -249,22 +257,32 @@ class TaskBase:
         """
         self.state.prepare_states(self.inputs)
         self.state.prepare_inputs()
+        # cached for the same version of the inputs and state indices
+        key = (getattr(self.inputs, "_spec_version", None), self.state.inputs_ind)
+        cached = self.__dict__.get("_checksum_states")
+        if key[0] is None or cached is None or cached[0] != key:
+            cached = (
+                key,
+                [
+                    self._checksum_state_element(ind)
+                    for ind in range(len(self.state.inputs_ind))
+                ],
+            )
+            self._checksum_states = cached
         if state_index is not None:
-            inputs_copy = deepcopy(self.inputs)
-            for key, ind in self.state.inputs_ind[state_index].items():
-                setattr(
-                    inputs_copy,
-                    key.split(".")[1],
-                    getattr(inputs_copy, key.split(".")[1])[ind],
-                )
-            input_hash = inputs_copy.hash
-            checksum_ind = create_checksum(self.__class__.__name__, input_hash)
-            return checksum_ind
-        else:
-            checksum_list = []
-            for ind in range(len(self.state.inputs_ind)):
-                checksum_list.append(self.checksum_states(state_index=ind))
-            return checksum_list
+            return cached[1][state_index]
+        return list(cached[1])
+
+    def _checksum_state_element(self, state_index):
+        """Calculate the checksum of a single (already prepared) state element."""
+        # a shallow copy is enough, the inputs are only read to compute the hash
+        inputs_copy = copy(self.inputs)
+        input_ind = self.state.inputs_ind[state_index]
+        for key, val_ind in input_ind.items():
+            inp = self._state_key_inputs.get(key)
+            if inp is not None:
+                setattr(inputs_copy, inp, getattr(self.inputs, inp)[val_ind])
+        return create_checksum(self.__class__.__name__, inputs_copy.hash)
 
     def set_state(self, splitter, combiner=None):
         """
@@ -368,17 +386,17 @@ class TaskBase:
         # TODO add signal handler for processes killed after lock acquisition
         with SoftFileLock(lockfile):
             if not rerun:
-                result = self.result()
+                result = load_result(checksum, self.cache_locations)
                 if result is not None:
                     return result
             # Let only one equivalent process run
-            odir = self.output_dir
+            odir = self.cache_dir / checksum
             if not self.can_resume and odir.exists():
                 shutil.rmtree(odir)
             cwd = os.getcwd()
             odir.mkdir(parents=False, exist_ok=True if self.can_resume else False)
             orig_inputs = attr.asdict(self.inputs)
-            map_copyfiles = copyfile_input(self.inputs, self.output_dir)
+            map_copyfiles = copyfile_input(self.inputs, odir)
             modified_inputs = template_update(self.inputs, map_copyfiles)
             if modified_inputs is not None:
                 self.inputs = attr.evolve(self.inputs, **modified_inputs)
@@ -390,7 +408,7 @@ class TaskBase:
                 self._run_task()
                 result.output = self._collect_outputs()
             except Exception as e:
-                record_error(self.output_dir, e)
+                record_error(odir, e)
                 result.errored = True
                 raise
             finally:
@@ -482,14 +500,11 @@ class TaskBase:
             # TODO: doesnt work properly for more cmplicated wf (check if still an issue)
             state_dict = self.state.states_val[ind]
             input_ind = self.state.inputs_ind[ind]
-            inputs_dict = {}
-            for inp in set(self.input_names):
-                if f"{self.name}.{inp}" in input_ind:
-                    inputs_dict[inp] = getattr(self.inputs, inp)[
-                        input_ind[f"{self.name}.{inp}"]
-                    ]
-                else:
-                    inputs_dict[inp] = getattr(self.inputs, inp)
+            inputs_dict = {inp: getattr(self.inputs, inp) for inp in self.input_names}
+            for key, val_ind in input_ind.items():
+                inp = self._state_key_inputs.get(key)
+                if inp is not None:
+                    inputs_dict[inp] = inputs_dict[inp][val_ind]
             return state_dict, inputs_dict
         else:
             # todo it never gets here
@@ -500,12 +515,22 @@ class TaskBase:
     def to_job(self, ind):
         """Run interface one element generated from node_state."""
         # logger.debug("Run interface el, name={}, ind={}".format(self.name, ind))
-        el = deepcopy(self)
+        # the state and the inputs (with all values to split over) are not copied
+        el = self.__class__.__new__(self.__class__)
+        el.__dict__.update(
+            deepcopy(
+                {
+                    key: val
+                    for key, val in self.__dict__.items()
+                    if key not in ["state", "inputs", "_checksum_states"]
+                }
+            )
+        )
         el.state = None
         # dj might be needed
         # el._checksum = None
         _, inputs_dict = self.get_input_el(ind)
-        el.inputs = attr.evolve(el.inputs, **inputs_dict)
+        el.inputs = deepcopy(attr.evolve(self.inputs, **inputs_dict))
         return el
 
     @property
@@ -516,30 +541,28 @@ class TaskBase:
             return False
         if self.state:
             # TODO: only check for needed state result
-            if self.result() and all(self.result()):
-                return True
-            # checking if self.result() is not an empty list only because
+            checksums = self.checksum_states()
+            if checksums:
+                return all(
+                    result_exists(checksum, self.cache_locations)
+                    for checksum in checksums
+                )
+            # checking if there are no results only because
             # the states_ind is an empty list (input field might be an empty list)
-            elif (
-                self.result() == []
-                and hasattr(self.state, "states_ind")
-                and self.state.states_ind == []
-            ):
-                return True
-        else:
-            if self.result():
-                return True
-        return False
+            return hasattr(self.state, "states_ind") and self.state.states_ind == []
+        return result_exists(self.checksum, self.cache_locations)
 
     def _combined_output(self):
         combined_results = []
-        for (gr, ind_l) in self.state.final_combined_ind_mapping.items():
-            combined_results.append([])
+        checksums = self.checksum_states()
+        for ind_l in self.state.final_combined_ind_mapping.values():
+            results_gr = []
             for ind in ind_l:
-                result = load_result(self.checksum_states(ind), self.cache_locations)
+                result = load_result(checksums[ind], self.cache_locations)
                 if result is None:
                     return None
-                combined_results[gr].append(result)
+                results_gr.append(result)
+            combined_results.append(results_gr)
         return combined_results
 
     def result(self, state_index=None):
@@ -587,9 +610,8 @@ class TaskBase:
 
     def _reset(self):
         """Reset the connections between inputs and LazyFields."""
-        for field in attr_fields(self.inputs):
-            if field.name in self.inp_lf:
-                setattr(self.inputs, field.name, self.inp_lf[field.name])
+        for name, lazy_field in self.inp_lf.items():
+            setattr(self.inputs, name, lazy_field)
         if is_workflow(self):
             for task in self.graph.nodes:
                 task._reset()
@@ -676,6 +698,8 @@ class Workflow(TaskBase):
 
         # store output connections
         self._connections = None
+        # set when the connections were just created (by the submitter) for a run
+        self._connections_ready = False
 
     def __getattr__(self, name):
         if name == "lzin":
@@ -698,10 +722,11 @@ class Workflow(TaskBase):
             That can be checked with :py:meth:`~Workflow.done`.
 
         """
-        for task in self.graph.nodes:
-            if not task.done:
-                return False
-        return True
+        return not self._tasks_not_done(self.graph.nodes)
+
+    def _tasks_not_done(self, tasks):
+        """Return the tasks (from the list provided) that are not done yet."""
+        return [task for task in tasks if not task.done]
 
     @property
     def nodes(self):
@@ -725,7 +750,12 @@ class Workflow(TaskBase):
         """
         if not is_task(task):
             raise ValueError("Unknown workflow element: {!r}".format(task))
-        self.graph.add_nodes(task)
+        old_task = self.name2obj.get(task.name)
+        if old_task is not None and old_task is not task:
+            # a task with the same name replaces the old one, which is removed
+            self.graph.replace_node(old_task, task)
+        else:
+            self.graph.add_nodes(task)
         self.name2obj[task.name] = task
         self._last_added = task
         logger.debug(f"Added {task}")
@@ -742,6 +772,8 @@ class Workflow(TaskBase):
 
         """
         other_states = {}
+        new_edges = []
+        task_predecessors = self.graph.predecessors[task.name]
         for field in attr_fields(task.inputs):
             val = getattr(task.inputs, field.name)
             if isinstance(val, LazyField):
@@ -749,18 +781,18 @@ class Workflow(TaskBase):
                 task.inp_lf[field.name] = val
                 # adding an edge to the graph if task id expecting output from a different task
                 if val.name != self.name:
+                    node = getattr(self, val.name)
                     # checking if the connection is already in the graph
-                    if (getattr(self, val.name), task) in self.graph.edges:
+                    if node in task_predecessors or (node, task) in new_edges:
                         continue
-                    self.graph.add_edges((getattr(self, val.name), task))
+                    new_edges.append((node, task))
                     logger.debug("Connecting %s to %s", val.name, task.name)
 
-                    if getattr(self, val.name).state:
+                    if node.state:
                         # adding a state from the previous task to other_states
-                        other_states[val.name] = (
-                            getattr(self, val.name).state,
-                            field.name,
-                        )
+                        other_states[val.name] = (node.state, field.name)
+        if new_edges:
+            self.graph.add_edges(new_edges)
         # if task has connections state has to be recalculated
         if other_states:
             if task.state:
@@ -785,17 +817,20 @@ class Workflow(TaskBase):
         lockfile = self.cache_dir / (checksum + ".lock")
         # Eagerly retrieve cached
         if not rerun:
-            result = self.result()
+            result = load_result(checksum, self.cache_locations)
             if result is not None:
                 return result
-        # creating connections that were defined after adding tasks to the wf
-        for task in self.graph.nodes:
-            self.create_connections(task)
+        # creating connections that were defined after adding tasks to the wf,
+        # unless they were created for this run and nothing could have changed
+        if not self._connections_ready:
+            for task in self.graph.nodes:
+                self.create_connections(task)
+        self._connections_ready = False
         # TODO add signal handler for processes killed after lock acquisition
         self.hooks.pre_run(self)
         with SoftFileLock(lockfile):
             # # Let only one equivalent process run
-            odir = self.output_dir
+            odir = self.cache_dir / checksum
             if not self.can_resume and odir.exists():
                 shutil.rmtree(odir)
             cwd = os.getcwd()
@@ -808,7 +843,7 @@ class Workflow(TaskBase):
                 await self._run_task(submitter)
                 result.output = self._collect_outputs()
             except Exception as e:
-                record_error(self.output_dir, e)
+                record_error(odir, e)
                 result.errored = True
                 raise
             finally:
@@ -856,10 +891,16 @@ class Workflow(TaskBase):
         output = output_klass(**{f.name: None for f in attr.fields(output_klass)})
         # collecting outputs from tasks
         output_wf = {}
+        node_results = {}
         for name, val in self._connections:
             if not isinstance(val, LazyField):
                 raise ValueError("all connections must be lazy")
-            output_wf[name] = val.get_value(self)
+            if val.attr_type == "output":
+                if val.name not in node_results:
+                    node_results[val.name] = getattr(self, val.name).result()
+                output_wf[name] = val.get_value_from_result(node_results[val.name])
+            else:
+                output_wf[name] = val.get_value(self)
         return attr.evolve(output, **output_wf)
 
 
@@ -1,5 +1,4 @@
 """Data structure to support :class:`~pydra.engine.core.Workflow` tasks."""
-from copy import copy
 from .helpers import ensure_list
 
 
@@ -20,12 +19,18 @@ class DiGraph:
 
         """
         self._nodes = []
+        # set with the same nodes, for fast membership checks
+        self._nodes_set = set()
         self.nodes = nodes
-        self._edges = []
+        # ordered dictionary keys, so an edge is removed without a search
+        self._edges = {}
         self.edges = edges
         self._create_connections()
         self._sorted_nodes = None
+        # previously sorted nodes (with the new ones), used when sorting again
+        self._presorted = None
         self._node_wip = []
+        self._node_wip_set = set()
 
     def copy(self):
         """
@@ -38,12 +43,18 @@ class DiGraph:
         cls = self.__class__
         new_graph = cls.__new__(cls)
         new_graph._nodes = self._nodes[:]
+        new_graph._nodes_set = set(self._nodes_set)
         new_graph._node_wip = self._node_wip[:]
-        new_graph._edges = self._edges[:]
+        new_graph._node_wip_set = set(self._node_wip_set)
+        new_graph._edges = dict(self._edges)
         if self._sorted_nodes:
             new_graph._sorted_nodes = self._sorted_nodes[:]
         else:
             new_graph._sorted_nodes = None
+        if self._presorted:
+            new_graph._presorted = self._presorted[:]
+        else:
+            new_graph._presorted = None
         new_graph.predecessors = {}
         for key, val in self.predecessors.items():
             new_graph.predecessors[key] = self.predecessors[key][:]
@@ -61,9 +72,11 @@ class DiGraph:
     def nodes(self, nodes):
         if nodes:
             nodes = ensure_list(nodes)
-            if len(set(nodes)) != len(nodes):
+            nodes_set = set(nodes)
+            if len(nodes_set) != len(nodes):
                 raise Exception("nodes have repeated elements")
             self._nodes = nodes
+            self._nodes_set = nodes_set
 
     @property
     def nodes_names_map(self):
@@ -73,19 +86,21 @@ class DiGraph:
     @property
     def edges(self):
         """Get a list of the links between nodes."""
-        return self._edges
+        return list(self._edges)
 
     @edges.setter
     def edges(self, edges):
         """Add edges to the graph (nodes should be already set)."""
         if edges:
             edges = ensure_list(edges)
-            for (nd_out, nd_in) in edges:
-                if nd_out not in self.nodes or nd_in not in self.nodes:
-                    raise Exception(
-                        f"edge {(nd_out, nd_in)} can't be added to the graph"
-                    )
-            self._edges = edges
+            self._check_edges(edges)
+            self._edges = dict.fromkeys(edges)
+
+    def _check_edges(self, edges):
+        """Check that all the nodes of the edges are in the graph."""
+        for (nd_out, nd_in) in edges:
+            if nd_out not in self._nodes_set or nd_in not in self._nodes_set:
+                raise Exception(f"edge {(nd_out, nd_in)} can't be added to the graph")
 
     @property
     def edges_names(self):
@@ -96,13 +111,13 @@ class DiGraph:
     def sorted_nodes(self):
         """Return sorted nodes (runs sorting if needed)."""
         if self._sorted_nodes is None:
-            self.sorting()
+            self.sorting(presorted=self._presorted)
         return self._sorted_nodes
 
     @property
     def sorted_nodes_names(self):
         """Return a list of sorted nodes names."""
-        return [nd.name for nd in self._sorted_nodes]
+        return [nd.name for nd in self.sorted_nodes]
 
     def _create_connections(self):
         """Create connections between nodes."""
@@ -117,24 +132,69 @@ class DiGraph:
             self.successors[nd_out.name].append(nd_in)
 
     def add_nodes(self, new_nodes):
-        """Insert new nodes and sort the new graph."""
-        self.nodes = self._nodes + ensure_list(new_nodes)
-        for nd in ensure_list(new_nodes):
+        """Insert new nodes, invalidating the cached sorting of the graph."""
+        new_nodes = ensure_list(new_nodes)
+        new_nodes_set = set(new_nodes)
+        if len(new_nodes_set) != len(new_nodes) or new_nodes_set & self._nodes_set:
+            raise Exception("nodes have repeated elements")
+        self._nodes = self._nodes + new_nodes
+        self._nodes_set |= new_nodes_set
+        for nd in new_nodes:
             self.predecessors[nd.name] = []
             self.successors[nd.name] = []
-        if self._sorted_nodes is not None:
-            # starting from the previous sorted list, so is faster
-            self.sorting(presorted=self.sorted_nodes + ensure_list(new_nodes))
+        self._invalidate_sorting(new_nodes)
+
+    def replace_node(self, old_node, new_node):
+        """
+        Replace a node by a new one, keeping its position in the list of nodes.
+
+        Connections of the old node are removed, so no reference to it is kept.
+
+        """
+        if old_node not in self._nodes_set:
+            raise Exception(f"{old_node} is not present in the graph")
+        if new_node in self._nodes_set:
+            raise Exception("nodes have repeated elements")
+        self._nodes = [new_node if nd is old_node else nd for nd in self._nodes]
+        self._nodes_set.remove(old_node)
+        self._nodes_set.add(new_node)
+        for nd_in in self.successors.pop(old_node.name):
+            self.predecessors[nd_in.name].remove(old_node)
+            self._edges.pop((old_node, nd_in), None)
+        for nd_out in self.predecessors.pop(old_node.name):
+            self.successors[nd_out.name].remove(old_node)
+            self._edges.pop((nd_out, old_node), None)
+        self.predecessors[new_node.name] = []
+        self.successors[new_node.name] = []
+        self._invalidate_sorting()
+        if self._presorted is not None:
+            self._presorted = [
+                new_node if nd is old_node else nd for nd in self._presorted
+            ]
 
     def add_edges(self, new_edges):
-        """Add new edges and sort the new graph."""
-        self.edges = self._edges + ensure_list(new_edges)
-        for (nd_out, nd_in) in ensure_list(new_edges):
+        """Add new edges, invalidating the cached sorting of the graph."""
+        new_edges = ensure_list(new_edges)
+        self._check_edges(new_edges)
+        self._edges.update(dict.fromkeys(new_edges))
+        for (nd_out, nd_in) in new_edges:
             self.predecessors[nd_in.name].append(nd_out)
             self.successors[nd_out.name].append(nd_in)
+        self._invalidate_sorting()
+
+    def _invalidate_sorting(self, new_nodes=()):
+        """
+        Mark the sorted nodes as outdated after the graph has changed.
+
+        The graph is sorted again only when the sorted nodes are requested,
+        starting from the previous sorted list (so it's faster).
+
+        """
         if self._sorted_nodes is not None:
-            # starting from the previous sorted list, so it's faster
-            self.sorting(presorted=self.sorted_nodes + [])
+            self._presorted = self._sorted_nodes + list(new_nodes)
+            self._sorted_nodes = None
+        elif self._presorted is not None:
+            self._presorted = self._presorted + list(new_nodes)
 
     def sorting(self, presorted=None):
         """
@@ -149,42 +209,58 @@ class DiGraph:
             A list of previously sorted nodes.
 
         """
-        self._sorted_nodes = []
         if presorted:
-            notsorted_nodes = copy(presorted)
+            notsorted_nodes = presorted
         else:
-            notsorted_nodes = copy(self.nodes)
-        predecessors = {key: copy(val) for (key, val) in self.predecessors.items()}
+            notsorted_nodes = self.nodes
+        self._presorted = None
+        self._sorted_nodes = list(self._iter_sorting(notsorted_nodes))
+        if len(self._sorted_nodes) != len(notsorted_nodes):
+            raise Exception("graph can't be sorted, it has a cycle")
 
-        # nodes that depends only on the self._nodes_wip should go first
-        # soe remove them from the connections
-        for nd_out in self._node_wip:
-            for nd_in in self.successors[nd_out.name]:
-                predecessors[nd_in.name].remove(nd_out)
+    def iter_sorted_nodes(self):
+        """
+        Iterate over sorted nodes, sorting the graph only as far as needed.
 
-        while notsorted_nodes:
-            sorted_part, notsorted_nodes = self._sorting(notsorted_nodes, predecessors)
-            self._sorted_nodes += sorted_part
-            for nd_out in sorted_part:
-                for nd_in in self.successors[nd_out.name]:
-                    predecessors[nd_in.name].remove(nd_out)
+        Useful when only the first nodes are used, the sorted nodes are not stored
+        if the graph has to be sorted. The graph can't be changed during iteration.
 
-    def _sorting(self, notsorted_list, predecessors):
         """
-        Sort implementation.
+        if self._sorted_nodes is not None:
+            return iter(self._sorted_nodes)
+        return self._iter_sorting(self._presorted or self.nodes)
 
-        Adding nodes that don't have predecessors to the sorted_parts,
-        returns sorted part and remaining nodes.
+    def _iter_sorting(self, notsorted_nodes):
+        """Generate sorted nodes, starting from a list of nodes."""
+        # position in the starting list, kept within every group of sorted nodes
+        position = {nd.name: ii for ii, nd in enumerate(notsorted_nodes)}
+        # counting the predecessors that are not sorted yet
+        pending = {nd.name: len(self.predecessors[nd.name]) for nd in notsorted_nodes}
 
-        """
-        remaining_nodes = []
-        sorted_part = []
-        for nd in notsorted_list:
-            if not predecessors[nd.name]:
-                sorted_part.append(nd)
-            else:
-                remaining_nodes.append(nd)
-        return sorted_part, remaining_nodes
+        # nodes that depends only on the self._nodes_wip should go first
+        # soe remove them from the connections
+        for nd_out in self._node_wip:
+            for nd_in in self.successors[nd_out.name]:
+                if nd_in.name in pending:
+                    pending[nd_in.name] -= 1
+
+        successors = self.successors
+        sorted_part = [nd for nd in notsorted_nodes if not pending[nd.name]]
+        while sorted_part:
+            yield from sorted_part
+            next_part = []
+            for nd_out in sorted_part:
+                for nd_in in successors[nd_out.name]:
+                    # nodes that are not sorted now are skipped
+                    nr_pending = pending.get(nd_in.name)
+                    if nr_pending is None:
+                        continue
+                    pending[nd_in.name] = nr_pending - 1
+                    if nr_pending == 1:
+                        next_part.append(nd_in)
+            if len(next_part) > 1:
+                next_part.sort(key=lambda nd: position[nd.name])
+            sorted_part = next_part
 
     def remove_nodes(self, nodes):
         """
@@ -205,23 +281,25 @@ class DiGraph:
         """
         nodes = ensure_list(nodes)
         for nd in nodes:
-            if nd not in self.nodes:
+            if nd not in self._nodes_set:
                 raise Exception(f"{nd} is not present in the graph")
             if self.predecessors[nd.name]:
                 raise Exception("this node shoudn't be run, has to wait")
             self.nodes.remove(nd)
+            self._nodes_set.remove(nd)
             # adding the node to self._node_wip as for
             self._node_wip.append(nd)
+            self._node_wip_set.add(nd)
         # if graph is sorted, the sorted list has to be updated
-        if hasattr(self, "sorted_nodes"):
-            if nodes == self.sorted_nodes[: len(nodes)]:
-                # if the first node is removed, no need to sort again
-                self._sorted_nodes = self.sorted_nodes[len(nodes) :]
-            else:
-                for nd in nodes:
-                    self._sorted_nodes.remove(nd)
-                # starting from the previous sorted list, so is faster
-                self.sorting(presorted=self.sorted_nodes)
+        if self._sorted_nodes is not None and nodes == self._sorted_nodes[: len(nodes)]:
+            # if the first node is removed, no need to sort again
+            self._sorted_nodes = self._sorted_nodes[len(nodes) :]
+        else:
+            # sorting again when needed, starting from the previous sorted list
+            self._invalidate_sorting()
+            if self._presorted is not None:
+                nodes_set = self._nodes_set
+                self._presorted = [nd for nd in self._presorted if nd in nodes_set]
 
     def remove_nodes_connections(self, nodes):
         """
@@ -239,26 +317,20 @@ class DiGraph:
         for nd in nodes:
             for nd_in in self.successors[nd.name]:
                 self.predecessors[nd_in.name].remove(nd)
-                self.edges.remove((nd, nd_in))
+                self._edges.pop((nd, nd_in), None)
             self.successors.pop(nd.name)
             self.predecessors.pop(nd.name)
             self._node_wip.remove(nd)
+            self._node_wip_set.remove(nd)
 
-    def _checking_path(self, node_name, first_name, path=0):
-        """Calculate all paths using connections list (re-entering function)."""
-        if not self.successors[node_name]:
-            return True
-        for nd_in in self.successors[node_name]:
-            if nd_in.name in self.max_paths[first_name].keys():
-                # chose the maximum paths
-                self.max_paths[first_name][nd_in.name] = max(
-                    self.max_paths[first_name][nd_in.name], path + 1
-                )
-            else:
-                self.max_paths[first_name][nd_in.name] = path + 1
-            self._checking_path(
-                node_name=nd_in.name, first_name=first_name, path=path + 1
-            )
+    def is_wip(self, node):
+        """
+        Check whether a node was removed, but its connections were not yet.
+
+        See :py:meth:`~DiGraph.remove_nodes`.
+
+        """
+        return node in self._node_wip_set
 
     def calculate_max_paths(self):
         """
@@ -270,6 +342,19 @@ class DiGraph:
         """
         self.max_paths = {}
         first_nodes = [key for (key, val) in self.predecessors.items() if not val]
+        pending = {key: len(val) for (key, val) in self.predecessors.items()}
+        names_sorted = first_nodes[:]
+        for name in names_sorted:
+            for nd_in in self.successors[name]:
+                pending[nd_in.name] -= 1
+                if not pending[nd_in.name]:
+                    names_sorted.append(nd_in.name)
         for nm in first_nodes:
-            self.max_paths[nm] = {}
-            self._checking_path(node_name=nm, first_name=nm)
+            paths = {nm: 0}
+            for name in names_sorted:
+                if name not in paths:
+                    continue
+                for nd_in in self.successors[name]:
+                    paths[nd_in.name] = max(paths.get(nd_in.name, 0), paths[name] + 1)
+            paths.pop(nm)
+            self.max_paths[nm] = paths
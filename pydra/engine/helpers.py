@@ -4,13 +4,45 @@ import asyncio.subprocess as asp
 import attr
 import cloudpickle as cp
 from pathlib import Path
+import numbers
 import os
+import pickle
+import pickletools
+import shutil
 import sys
+import warnings
+import weakref
+from functools import lru_cache
 from hashlib import sha256
 import subprocess as sp
 
 from .specs import Runtime, File, attr_fields
 
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+def _env_flag(name):
+    """Whether the environment variable ``name`` is set to a true value."""
+    return os.environ.get(name, "").lower() in ("1", "true", "yes")
+
+
+PYDRA_COMPRESS = _env_flag("PYDRA_COMPRESS")
+"""Whether pickled task and result files are written lz4-compressed."""
+
+PYDRA_OUT_OF_BAND = _env_flag("PYDRA_OUT_OF_BAND")
+"""
+Whether large result buffers (e.g. numpy array data) are written as separate
+files in ``_result.buffers``, instead of being pickled into ``_result.pklz``.
+"""
+
+_LZ4_MAGIC = b"\x04\x22\x4d\x18"
+
+_OUT_OF_BAND_MIN_SIZE = 1 << 20
+"""Size in bytes above which result buffers are written next to the pickle."""
+
 
 def ensure_list(obj, tuple2list=False):
     """
@@ -32,6 +64,8 @@ def ensure_list(obj, tuple2list=False):
     [5.0]
 
     """
+    if type(obj) is list:
+        return obj
     if obj is None:
         return []
     if isinstance(obj, list):
@@ -69,6 +103,36 @@ def print_help(obj):
     return lines
 
 
+def _locate_result(checksum, cache_locations):
+    """Return the path of a finished result file, or None if there is none."""
+    tail = f"{os.sep}{checksum}{os.sep}_result.pklz"
+    for location in cache_locations or []:
+        result_file = f"{location}{tail}"
+        try:
+            result_size = os.stat(result_file).st_size
+        except FileNotFoundError:
+            continue
+        # an empty file is still being written
+        return Path(result_file) if result_size > 0 else None
+    return None
+
+
+def result_exists(checksum, cache_locations):
+    """
+    Check whether a result is stored in the cache, without loading it.
+
+    Parameters
+    ----------
+    checksum : :obj:`str`
+        Unique identifier of the task.
+    cache_locations : :obj:`list` of :obj:`os.pathlike`
+        List of cache directories, in order of priority, where
+        the checksum will be looked for.
+
+    """
+    return _locate_result(checksum, cache_locations) is not None
+
+
 def load_result(checksum, cache_locations):
     """
     Restore a result from the cache.
@@ -82,15 +146,11 @@ def load_result(checksum, cache_locations):
         the checksum will be looked for.
 
     """
-    if not cache_locations:
+    result_file = _locate_result(checksum, cache_locations)
+    if result_file is None:
         return None
-    for location in cache_locations:
-        if (location / checksum).exists():
-            result_file = location / checksum / "_result.pklz"
-            if result_file.exists() and result_file.stat().st_size > 0:
-                return cp.loads(result_file.read_bytes())
-            return None
-    return None
+    buffers = _read_buffers(result_file.parent / "_result.buffers")
+    return _loads(result_file.read_bytes(), buffers=buffers)
 
 
 def save(task_path: Path, result=None, task=None):
@@ -111,11 +171,141 @@ def save(task_path: Path, result=None, task=None):
         raise ValueError("Nothing to be saved")
     task_path.mkdir(parents=True, exist_ok=True)
     if result:
-        with (task_path / "_result.pklz").open("wb") as fp:
-            cp.dump(result, fp)
+        use_buffers = PYDRA_OUT_OF_BAND and pickle.HIGHEST_PROTOCOL >= 5
+        buffers = [] if use_buffers else None
+        data = _dumps(result, buffers=buffers)
+        # buffers are written first, a result is loaded once its pickle exists
+        _write_buffers(task_path / "_result.buffers", buffers)
+        (task_path / "_result.pklz").write_bytes(data)
     if task:
-        with (task_path / "_task.pklz").open("wb") as fp:
-            cp.dump(task, fp)
+        # tasks are loaded by other processes (workers, the slurm pyscript),
+        # so functions defined in the running script have to be stored by value
+        (task_path / "_task.pklz").write_bytes(_dumps(task, by_value=True))
+
+
+def _dumps(obj, buffers=None, by_value=False):
+    """
+    Pickle an object, preferring the C pickler over cloudpickle.
+
+    Objects that the standard pickler cannot handle (e.g. lambdas or
+    dynamically defined classes), or that refer to ``__main__``, are serialized
+    with cloudpickle instead, as is everything if ``by_value`` is set.
+    Both produce regular pickle streams, so :func:`pickle.loads` reads either.
+
+    If ``buffers`` is a list (pickle protocol 5 only), large contiguous
+    buffers such as numpy array data are appended to it as
+    :class:`pickle.PickleBuffer` objects instead of being copied into the stream.
+
+    """
+    kwargs = {}
+    if buffers is not None:
+
+        def _buffer_callback(buf):
+            if buf.raw().nbytes < _OUT_OF_BAND_MIN_SIZE:
+                return True  # small buffers stay in-band
+            buffers.append(buf)
+            return False
+
+        kwargs["buffer_callback"] = _buffer_callback
+    data = None
+    if not by_value:
+        try:
+            data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL, **kwargs)
+        except (pickle.PicklingError, AttributeError):
+            pass
+    # references to __main__ can't be resolved in a different process
+    if data is None or _refers_to_main(data):
+        if buffers is not None:
+            del buffers[:]
+        data = cp.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL, **kwargs)
+    if PYDRA_COMPRESS:
+        if lz4 is None:
+            raise ImportError("PYDRA_COMPRESS is set, but lz4 is not installed")
+        data = lz4.frame.compress(data, compression_level=0)
+    return data
+
+
+def _refers_to_main(data):
+    """Check whether a pickle stream refers to a global of ``__main__``."""
+    if b"__main__" not in data:
+        return False
+    # the module and the name of STACK_GLOBAL are the last two strings pushed,
+    # directly or (if already used) from the memo
+    memo = {}
+    pushed = (None, None)
+    for opcode, arg, _ in pickletools.genops(data):
+        name = opcode.name
+        if name in ("GLOBAL", "INST"):
+            if arg.split(" ", 1)[0] == "__main__":
+                return True
+        elif name == "STACK_GLOBAL":
+            if pushed[0] == "__main__":
+                return True
+        elif name == "MEMOIZE":
+            memo[len(memo)] = pushed[1]
+            continue
+        elif name in ("PUT", "BINPUT", "LONG_BINPUT"):
+            memo[arg] = pushed[1]
+            continue
+        elif name in ("FRAME", "PROTO"):
+            continue
+        if name in ("GET", "BINGET", "LONG_BINGET"):
+            value = memo.get(arg)
+        else:
+            value = arg if isinstance(arg, str) else None
+        pushed = (pushed[1], value)
+    return False
+
+
+def _loads(data, buffers=None):
+    """Unpickle the content of a file written by :func:`save`."""
+    # checking the magic bytes, so uncompressed caches remain readable
+    if data[:4] == _LZ4_MAGIC:
+        if lz4 is None:
+            raise ImportError("lz4 is required to read compressed pydra files")
+        data = lz4.frame.decompress(data)
+    if buffers:
+        return pickle.loads(data, buffers=buffers)
+    return pickle.loads(data)
+
+
+def _write_buffers(buffers_dir, buffers):
+    """Write out-of-band pickle buffers, one file per buffer."""
+    if buffers_dir.exists():
+        shutil.rmtree(buffers_dir)
+    if not buffers:
+        return
+    buffers_dir.mkdir()
+    for ii, buf in enumerate(buffers):
+        with (buffers_dir / f"{ii:03d}.bin").open("wb") as fp:
+            fp.write(buf.raw())
+
+
+def _read_buffers(buffers_dir):
+    """Read the buffers written by :func:`_write_buffers`, in order."""
+    if not buffers_dir.exists():
+        return None
+    buffers = []
+    for buf_file in sorted(buffers_dir.iterdir(), key=lambda path: int(path.stem)):
+        # a writable buffer, so unpickled arrays are not read-only
+        buf = bytearray(buf_file.stat().st_size)
+        with buf_file.open("rb") as fp:
+            fp.readinto(buf)
+        buffers.append(buf)
+    return buffers
+
+
+def load_task(task_pkl):
+    """
+    Load a task written by :func:`save`.
+
+    Parameters
+    ----------
+    task_pkl : :obj:`os.pathlike`
+        Path to the ``_task.pklz`` file.
+
+    """
+    return _loads(Path(task_pkl).read_bytes())
 
 
 def task_hash(task):
@@ -133,6 +323,37 @@ def task_hash(task):
     return NotImplementedError
 
 
+def _prof_peaks_python(fname):
+    """Read the peak cpu, rss and vms values of a .prof file (None if it's empty)."""
+    data = [
+        [float(el) for el in line.strip().split(",")]
+        for line in Path(fname).read_text().splitlines()
+    ]
+    if not data:
+        return None
+    return tuple(max([val[ii] for val in data]) for ii in (1, 2, 3))
+
+
+@lru_cache(maxsize=None)
+def _prof_peaks_reader():
+    """Choose (once) how .prof files are read, with numpy if it's installed."""
+    try:
+        import numpy as np
+    except ImportError:
+        return _prof_peaks_python
+
+    def _prof_peaks_numpy(fname):
+        with warnings.catch_warnings():
+            # numpy warns about empty files
+            warnings.simplefilter("ignore", UserWarning)
+            data = np.loadtxt(fname, delimiter=",", ndmin=2)
+        if not data.size:
+            return None
+        return tuple(data.max(axis=0)[1:4].tolist())
+
+    return _prof_peaks_numpy
+
+
 def gather_runtime_info(fname):
     """
     Extract runtime information from a file.
@@ -151,14 +372,12 @@ def gather_runtime_info(fname):
     runtime = Runtime(rss_peak_gb=None, vms_peak_gb=None, cpu_peak_percent=None)
 
     # Read .prof file in and set runtime values
-    data = [
-        [float(el) for el in line.strip().split(",")]
-        for line in Path(fname).read_text().splitlines()
-    ]
-    if data:
-        runtime.rss_peak_gb = max([val[2] for val in data]) / 1024
-        runtime.vms_peak_gb = max([val[3] for val in data]) / 1024
-        runtime.cpu_peak_percent = max([val[1] for val in data])
+    peaks = _prof_peaks_reader()(fname)
+    if peaks is not None:
+        cpu_peak, rss_peak, vms_peak = peaks
+        runtime.rss_peak_gb = rss_peak / 1024
+        runtime.vms_peak_gb = vms_peak / 1024
+        runtime.cpu_peak_percent = cpu_peak
 
     """
     runtime.prof_dict = {
@@ -171,10 +390,17 @@ def gather_runtime_info(fname):
     return runtime
 
 
+_klass_cache = {}
+"""Classes created by :func:`make_klass`, keyed by the id of the spec."""
+
+
 def make_klass(spec):
     """
     Create a data class given a spec.
 
+    Classes are cached per spec object and reused as long as
+    the spec's name, bases and fields stay unchanged.
+
     Parameters
     ----------
     spec :
@@ -183,6 +409,26 @@ def make_klass(spec):
     """
     if spec is None:
         return None
+    key = id(spec)
+    cached = _klass_cache.get(key)
+    if cached is not None:
+        spec_ref, name, bases, fields, klass = cached
+        if (
+            spec_ref() is spec
+            and name == spec.name
+            and bases == spec.bases
+            and fields == spec.fields
+        ):
+            return klass
+    klass = _make_klass(spec)
+    # the entry is dropped together with the spec, so the id can't be reused
+    spec_ref = weakref.ref(spec, lambda _, key=key: _klass_cache.pop(key, None))
+    _klass_cache[key] = (spec_ref, spec.name, spec.bases, list(spec.fields), klass)
+    return klass
+
+
+def _make_klass(spec):
+    """Create a data class given a spec (without caching)."""
     fields = spec.fields
     if fields:
         newfields = dict()
@@ -202,53 +448,61 @@ def make_klass(spec):
     return attr.make_class(spec.name, fields, bases=spec.bases, kw_only=True)
 
 
-async def read_stream_and_display(stream, display):
-    """
-    Read from stream line by line until EOF, display, and capture the lines.
+class _CaptureProtocol(asyncio.SubprocessProtocol):
+    """Collect the standard output and error of a process as they arrive."""
 
-    See Also
-    --------
-    This `discussion on StackOverflow
-    <https://stackoverflow.com/questions/17190221>`__.
+    def __init__(self, finished, hide_display=False):
+        self.finished = finished
+        self.output = {1: bytearray(), 2: bytearray()}
+        self.display = {
+            1: sys.stdout.buffer.write if not hide_display else None,
+            2: sys.stderr.buffer.write if not hide_display else None,
+        }
 
-    """
-    output = []
-    while True:
-        line = await stream.readline()
-        if not line:
-            break
-        output.append(line)
-        if display is not None:
-            display(line)  # assume it doesn't block
-    return b"".join(output).decode()
+    def pipe_data_received(self, fd, data):
+        self.output[fd] += data
+        if self.display[fd] is not None:
+            self.display[fd](data)  # assume it doesn't block
+
+    def connection_lost(self, exc):
+        # called once the process has exited and all its pipes are closed
+        if not self.finished.done():
+            self.finished.set_result(None)
 
 
 async def read_and_display_async(*cmd, hide_display=False, strip=False):
     """
     Capture standard input and output of a process, displaying them as they arrive.
 
-    Works line-by-line.
+    The output is received in chunks by a :class:`asyncio.SubprocessProtocol`,
+    rather than awaiting each line of both streams.
+
+    See Also
+    --------
+    This `discussion on StackOverflow
+    <https://stackoverflow.com/questions/17190221>`__.
 
     """
+    loop = asyncio.get_event_loop()
+    finished = loop.create_future()
     # start process
-    process = await asyncio.create_subprocess_exec(
-        *cmd, stdout=asp.PIPE, stderr=asp.PIPE
+    transport, protocol = await loop.subprocess_exec(
+        lambda: _CaptureProtocol(finished, hide_display=hide_display),
+        *cmd,
+        stdin=None,
+        stdout=asp.PIPE,
+        stderr=asp.PIPE,
     )
-
-    stdout_display = sys.stdout.buffer.write if not hide_display else None
-    stderr_display = sys.stderr.buffer.write if not hide_display else None
-    # read child's stdout/stderr concurrently (capture and display)
     try:
-        stdout, stderr = await asyncio.gather(
-            read_stream_and_display(process.stdout, stdout_display),
-            read_stream_and_display(process.stderr, stderr_display),
-        )
+        await finished
     except Exception:
-        process.kill()
+        transport.kill()
         raise
     finally:
-        # wait for the process to exit
-        rc = await process.wait()
+        rc = transport.get_returncode()
+        transport.close()
+    stdout = protocol.output[1].decode()
+    stderr = protocol.output[2].decode()
     if strip:
         return rc, stdout.strip(), stderr
     else:
@@ -320,8 +574,7 @@ def create_checksum(name, inputs):
 
 def record_error(error_path, error):
     """Write an error file."""
-    with (error_path / "_error.pklz").open("wb") as fp:
-        cp.dump(error, fp)
+    (error_path / "_error.pklz").write_bytes(_dumps(error))
 
 
 def get_open_loop():
@@ -348,6 +601,24 @@ def get_open_loop():
     return loop
 
 
+_PYSCRIPT_TEMPLATE = """from pathlib import Path
+from pydra.engine.helpers import load_task
+
+
+cache_path = Path("%s")
+task_pkl = (cache_path / "_task.pklz")
+task = load_task(task_pkl)
+
+# submit task
+task(rerun=%s)
+
+if not task.result():
+    raise Exception("Something went wrong")
+print("Completed", task.checksum, task)
+task_pkl.unlink()
+"""
+
+
 def create_pyscript(script_path, checksum, rerun=False):
     """
     Create standalone script for task execution in a different environment.
@@ -366,34 +637,88 @@ def create_pyscript(script_path, checksum, rerun=False):
 
     """
     task_pkl = script_path / "_task.pklz"
-    if not task_pkl.exists() or not task_pkl.stat().st_size:
+    try:
+        task_size = task_pkl.stat().st_size
+    except FileNotFoundError:
+        task_size = 0
+    if not task_size:
         raise Exception("Missing or empty task!")
 
-    content = f"""import cloudpickle as cp
-from pathlib import Path
+    pyscript = script_path / f"pyscript_{checksum}.py"
+    pyscript.write_text(_PYSCRIPT_TEMPLATE % (script_path, rerun))
+    return pyscript
 
 
-cache_path = Path("{str(script_path)}")
-task_pkl = (cache_path / "_task.pklz")
-task = cp.loads(task_pkl.read_bytes())
+_hash_builtin_types = frozenset((str, bytes, int, bool, float, list, tuple, dict))
+_end_of_container = object()
+"""Marks the end of the elements of a container on the stack of hash_function."""
 
-# submit task
-task(rerun={rerun})
 
-if not task.result():
-    raise Exception("Something went wrong")
-print("Completed", task.checksum, task)
-task_pkl.unlink()
-"""
-    pyscript = script_path / f"pyscript_{checksum}.py"
-    with pyscript.open("wt") as fp:
-        fp.writelines(content)
-    return pyscript
+def hash_function(obj):
+    """
+    Generate hash of object.
 
+    The object is walked with an explicit stack and fed to a single sha256 object,
+    instead of hashing its (potentially huge) string representation.
+    Builtin containers and scalars are encoded with a type tag and a length prefix,
+    numbers (e.g. numpy scalars) are converted to builtin ``int``/``float`` first,
+    and any other object is represented by its ``repr``.
+    A container that (directly or indirectly) contains itself is encoded as
+    a reference to the enclosing level.
 
-def hash_function(obj):
-    """Generate hash of object."""
-    return sha256(str(obj).encode()).hexdigest()
+    """
+    crypto_obj = sha256()
+    update = crypto_obj.update
+    stack = [obj]
+    # ids of the containers being walked (and their nesting levels)
+    path = []
+    levels = {}
+    while stack:
+        el = stack.pop()
+        if el is _end_of_container:
+            del levels[path.pop()]
+            continue
+        el_type = type(el)
+        if el_type not in _hash_builtin_types:
+            if isinstance(el, numbers.Integral) and not isinstance(el, bool):
+                el = int(el)
+            elif isinstance(el, numbers.Real):
+                el = float(el)
+            el_type = type(el)
+        if el_type is str:
+            data = el.encode()
+            update(b"s%d:" % len(data))
+            update(data)
+        elif el_type is bytes:
+            update(b"b%d:" % len(el))
+            update(el)
+        elif el_type is int:
+            update(b"i%d;" % el)
+        elif el_type is bool or el is None:
+            update(b"c%r;" % el)
+        elif el_type is float:
+            update(b"f%r;" % el)
+        elif el_type in (list, tuple, dict) and id(el) in levels:
+            update(b"^%d;" % (len(path) - levels[id(el)]))
+        elif el_type is list or el_type is tuple:
+            update(b"%s%d[" % (b"l" if el_type is list else b"t", len(el)))
+            levels[id(el)] = len(path)
+            path.append(id(el))
+            stack.append(_end_of_container)
+            stack.extend(reversed(el))
+        elif el_type is dict:
+            update(b"d%d{" % len(el))
+            levels[id(el)] = len(path)
+            path.append(id(el))
+            stack.append(_end_of_container)
+            for key, val in reversed(list(el.items())):
+                stack.append(val)
+                stack.append(key)
+        else:
+            data = repr(el).encode()
+            update(b"r%d:" % len(data))
+            update(data)
+    return crypto_obj.hexdigest()
 
 
 def output_names_from_inputfields(inputs):
@@ -406,15 +731,21 @@ def output_names_from_inputfields(inputs):
         TODO
 
     """
+    return list(_output_names_from_klass(type(inputs)))
+
+
+@lru_cache(maxsize=256)
+def _output_names_from_klass(klass):
+    """Output names defined by the (immutable) fields of an input class."""
     output_names = []
-    for fld in attr_fields(inputs):
+    for fld in attr.fields(klass):
         if "output_file_template" in fld.metadata:
             if "output_field_name" in fld.metadata:
                 field_name = fld.metadata["output_field_name"]
             else:
                 field_name = fld.name
             output_names.append(field_name)
-    return output_names
+    return tuple(output_names)
 
 
 def output_from_inputfields(output_spec, inputs):
@@ -1,19 +1,29 @@
 """Functions ported from Nipype 1, after removing parts that were related to py2."""
 import attr
 import subprocess as sp
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import hashlib
 from hashlib import sha256
+import mmap
 import os
 import os.path as op
 import re
 import shutil
 import posixpath
+import sys
 from builtins import str, bytes, open
 import logging
 from pathlib import Path
 
+from .helpers import ensure_list
+
 related_filetype_sets = [(".hdr", ".img", ".mat"), (".nii", ".mat"), (".BRIK", ".HEAD")]
 """List of neuroimaging file types that are to be interpreted together."""
 
+special_extensions = (".nii.gz", ".tar.gz", ".niml.dset")
+"""Multi-part extensions that :func:`split_filename` keeps together (lower case)."""
+
 logger = logging.getLogger("pydra")
 
 
@@ -48,18 +58,18 @@ def split_filename(fname):
     '.nii.gz'
 
     """
-    special_extensions = [".nii.gz", ".tar.gz", ".niml.dset"]
-
     pth = op.dirname(fname)
     fname = op.basename(fname)
 
     ext = None
-    for special_ext in special_extensions:
-        ext_len = len(special_ext)
-        if (len(fname) > ext_len) and (fname[-ext_len:].lower() == special_ext.lower()):
-            ext = fname[-ext_len:]
-            fname = fname[:-ext_len]
-            break
+    lower_fname = fname.lower()
+    if lower_fname.endswith(special_extensions):
+        for special_ext in special_extensions:
+            ext_len = len(special_ext)
+            if len(fname) > ext_len and lower_fname.endswith(special_ext):
+                ext = fname[-ext_len:]
+                fname = fname[:-ext_len]
+                break
     if not ext:
         fname, ext = op.splitext(fname)
 
@@ -97,24 +107,57 @@ def fname_presuffix(fname, prefix="", suffix="", newpath=None, use_ext=True):
     '/tmp/prefoopost.nii.gz'
 
     """
+    # relative paths depend on the working directory, so it is part of the cache key
+    cwd = None
+    if newpath and not op.isabs(newpath):
+        cwd = os.getcwd()
+    return _fname_presuffix(fname, prefix, suffix, newpath, use_ext, cwd)
+
+
+@lru_cache(maxsize=1024)
+def _fname_presuffix(fname, prefix, suffix, newpath, use_ext, cwd):
     pth, fname, ext = split_filename(fname)
     if not use_ext:
         ext = ""
 
     # No need for isdefined: bool(Undefined) evaluates to False
     if newpath:
-        pth = op.abspath(newpath)
+        # equivalent to op.abspath, without querying the working directory again
+        pth = op.normpath(op.join(cwd, newpath) if cwd else newpath)
     return op.join(pth, prefix + fname + suffix + ext)
 
 
-def hash_file(afile, chunk_len=8192, crypto=sha256, raise_notfound=True):
-    """Compute hash of a file using 'crypto' module."""
+def _advise_sequential(fp):
+    """Tell the kernel that a file will be read sequentially (POSIX only)."""
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fp.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            # e.g. the file is a pipe or the file system doesn't support it
+            pass
+
+
+def hash_file(afile, chunk_len=1 << 20, crypto=sha256, raise_notfound=True):
+    """
+    Compute hash of a file using 'crypto' module.
+
+    On Python >= 3.11 the reading loop is delegated to :func:`hashlib.file_digest`,
+    otherwise the file is memory-mapped and fed to ``crypto`` in ``chunk_len`` slices.
+
+    """
     from .specs import LazyField
     from .helpers import hash_function
 
     # adding option for tasks with splitter over list of files
     if isinstance(afile, list):
-        return hash_function([hash_file(el) for el in afile])
+        files = list(_flatten_list(afile))
+        if len(files) > 1:
+            # hashlib releases the GIL, so the files can be hashed concurrently
+            with ThreadPoolExecutor(max_workers=min(8, len(files))) as pool:
+                hashes = list(pool.map(hash_file, files))
+        else:
+            hashes = [hash_file(el) for el in files]
+        return _nested_hash(afile, iter(hashes))
 
     if afile is None or isinstance(afile, LazyField) or isinstance(afile, list):
         return None
@@ -123,16 +166,73 @@ def hash_file(afile, chunk_len=8192, crypto=sha256, raise_notfound=True):
             raise RuntimeError('File "%s" not found.' % afile)
         return None
 
-    crypto_obj = crypto()
     with open(afile, "rb") as fp:
-        while True:
-            data = fp.read(chunk_len)
-            if not data:
-                break
-            crypto_obj.update(data)
+        _advise_sequential(fp)
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(fp, crypto).hexdigest()
+        crypto_obj = crypto()
+        # empty files can't be memory-mapped
+        if os.fstat(fp.fileno()).st_size:
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                with memoryview(mm) as view:
+                    for start in range(0, len(view), chunk_len):
+                        crypto_obj.update(view[start : start + chunk_len])
     return crypto_obj.hexdigest()
 
 
+def _flatten_list(nested):
+    """Yield the elements of a nested list, in order."""
+    for el in nested:
+        if isinstance(el, list):
+            yield from _flatten_list(el)
+        else:
+            yield el
+
+
+def _nested_hash(nested, hashes):
+    """Combine the hashes of the elements, following the nested list structure."""
+    from .helpers import hash_function
+
+    return hash_function(
+        [
+            _nested_hash(el, hashes) if isinstance(el, list) else next(hashes)
+            for el in nested
+        ]
+    )
+
+
+def _files_equal(afile, bfile, chunk_len=1 << 20):
+    """
+    Compare the content of two files.
+
+    Files are read chunk by chunk into preallocated buffers
+    and the comparison stops at the first chunk that differs.
+
+    """
+    if os.path.getsize(afile) != os.path.getsize(bfile):
+        return False
+    abuf, bbuf = memoryview(bytearray(chunk_len)), memoryview(bytearray(chunk_len))
+    with open(afile, "rb") as afp, open(bfile, "rb") as bfp:
+        _advise_sequential(afp)
+        _advise_sequential(bfp)
+        while True:
+            alen = afp.readinto(abuf)
+            blen = bfp.readinto(bbuf)
+            if alen != blen:
+                return False
+            if not alen:
+                return True
+            if abuf[:alen] != bbuf[:blen]:
+                return False
+
+
+# Linux mount example:  sysfs on /sys type sysfs (rw,nosuid,nodev,noexec)
+#                          <PATH>^^^^      ^^^^^<FSTYPE>
+# OSX mount example:    /dev/disk2 on / (hfs, local, journaled)
+#                               <PATH>^  ^^^<FSTYPE>
+_MOUNT_RE = re.compile(r".*? on (/.*?) (?:type |\()([^\s,\)]+)")
+
+
 def _parse_mount_table(exit_code, output):
     """
     Parse the output of ``mount`` to produce (path, fs_type) pairs.
@@ -145,33 +245,56 @@ def _parse_mount_table(exit_code, output):
     if exit_code != 0:
         return []
 
-    # Linux mount example:  sysfs on /sys type sysfs (rw,nosuid,nodev,noexec)
-    #                          <PATH>^^^^      ^^^^^<FSTYPE>
-    # OSX mount example:    /dev/disk2 on / (hfs, local, journaled)
-    #                               <PATH>^  ^^^<FSTYPE>
-    pattern = re.compile(r".*? on (/.*?) (?:type |\()([^\s,\)]+)")
-
-    # Keep line and match for error reporting (match == None on failure)
-    # Ignore empty lines
-    matches = [(l, pattern.match(l)) for l in output.strip().splitlines() if l]
-
-    # (path, fstype) tuples, sorted by path length (longest first)
-    mount_info = sorted(
-        (match.groups() for _, match in matches if match is not None),
-        key=lambda x: len(x[0]),
-        reverse=True,
-    )
-    cifs_paths = [path for path, fstype in mount_info if fstype.lower() == "cifs"]
-
-    # Report failures as warnings
-    for line, match in matches:
+    # (path, fstype) tuples, ignoring empty lines
+    mount_info = []
+    for line in output.strip().splitlines():
+        if not line:
+            continue
+        match = _MOUNT_RE.match(line)
         if match is None:
+            # Report failures as warnings
             logger.debug("Cannot parse mount line: '%s'", line)
+        else:
+            mount_info.append(match.groups())
+    return _cifs_mounts(mount_info)
+
 
+def _parse_mountinfo(content):
+    """
+    Parse the content of ``/proc/self/mountinfo`` to produce (path, fs_type) pairs.
+
+    Each line lists the mount point as its fifth field, and the file system
+    type right after the ``-`` separating the optional fields.
+
+    """
+    mount_info = []
+    for line in content.splitlines():
+        fields = line.split()
+        try:
+            separator = fields.index("-", 6)
+            mount_info.append((_unescape_mountinfo(fields[4]), fields[separator + 1]))
+        except (ValueError, IndexError):
+            logger.debug("Cannot parse mountinfo line: '%s'", line)
+    return _cifs_mounts(mount_info)
+
+
+def _unescape_mountinfo(path):
+    """Decode the octal escapes (e.g. ``\\040`` for a space) of mountinfo paths."""
+    return re.sub(r"\\([0-7]{3})", lambda match: chr(int(match.group(1), 8)), path)
+
+
+def _cifs_mounts(mount_info):
+    """Select the mount points that fall under a CIFS mount."""
+    # sorted by path length (longest first)
+    mount_info.sort(key=lambda x: len(x[0]), reverse=True)
+    cifs_paths = [path for path, fstype in mount_info if fstype.lower() == "cifs"]
+
+    # whole path components only, /mnt/foobar is not under /mnt/foo
+    cifs_prefixes = tuple(path.rstrip("/") + "/" for path in cifs_paths)
     return [
         mount
         for mount in mount_info
-        if any(mount[0].startswith(path) for path in cifs_paths)
+        if mount[0] in cifs_paths or mount[0].startswith(cifs_prefixes)
     ]
 
 
@@ -181,15 +304,60 @@ def _generate_cifs_table():
 
     This precomputation allows efficient checking for whether a given path
     would be on a CIFS filesystem.
+    The mount table is read from ``/proc/self/mountinfo`` on Linux, and from
+    the output of ``mount`` elsewhere.
     On systems without a ``mount`` command, or with no CIFS mounts, returns an
     empty list.
 
     """
+    # on Linux the kernel provides the mount table, no need to run ``mount``
+    if sys.platform.startswith("linux"):
+        try:
+            with open("/proc/self/mountinfo") as fp:
+                return _parse_mountinfo(fp.read())
+        except OSError:
+            pass
     exit_code, output = sp.getstatusoutput("mount")
     return _parse_mount_table(exit_code, output)
 
 
-_cifs_table = _generate_cifs_table()
+def _build_cifs_trie(table):
+    """
+    Build a prefix tree over the path components of the mount points in ``table``.
+
+    Every node is a dictionary mapping a path component to its child node,
+    nodes of mount points also store the file system type under the ``None`` key.
+
+    """
+    trie = {}
+    for path, fstype in table:
+        node = trie
+        for part in path.split("/"):
+            if part:
+                node = node.setdefault(part, {})
+        # if a mount point is listed more than once, the first entry counts
+        node.setdefault(None, fstype)
+    return trie
+
+
+# filled on first use, most processes never check for CIFS paths
+_cifs_table = []
+_cifs_trie = None
+
+
+def refresh_cifs_table(table=None):
+    """
+    Regenerate the cached table of CIFS mounts (e.g., after mounting a share).
+
+    Parameters
+    ----------
+    table : :obj:`list` of :obj:`tuple`, optional
+        (path, fs_type) pairs to be used instead of the ones read from ``mount``.
+
+    """
+    global _cifs_trie
+    _cifs_table[:] = _generate_cifs_table() if table is None else table
+    _cifs_trie = _build_cifs_trie(_cifs_table)
 
 
 def on_cifs(fname):
@@ -208,11 +376,65 @@ def on_cifs(fname):
     This check is written to support disabling symlinks on CIFS shares.
 
     """
-    # Only the first match (most recent parent) counts
-    for fspath, fstype in _cifs_table:
-        if fname.startswith(fspath):
-            return fstype == "cifs"
-    return False
+    return _walk_cifs_trie(os.fspath(fname))[1] == "cifs"
+
+
+def on_cifs_bulk(paths):
+    """
+    Check whether each of the file paths is on a CIFS filesystem.
+
+    Paths are grouped by their parent directory, which is looked up once per
+    directory, see :func:`on_cifs`.
+
+    Parameters
+    ----------
+    paths : :obj:`list` of :obj:`os.pathlike`
+        File paths to be checked.
+
+    Returns
+    -------
+    on_cifs : :obj:`list` of :obj:`bool`
+        Whether the path at the same position is on a CIFS filesystem.
+
+    """
+    dirs = {}
+    results = []
+    for path in paths:
+        dirname, basename = op.split(os.fspath(path))
+        if dirname not in dirs:
+            dirs[dirname] = _walk_cifs_trie(dirname)
+        node, fstype = dirs[dirname]
+        # the path itself might be a mount point
+        if node is not None and basename in node:
+            fstype = node[basename].get(None, fstype)
+        results.append(fstype == "cifs")
+    return results
+
+
+def _walk_cifs_trie(path):
+    """
+    Follow ``path`` down the prefix tree of mount points.
+
+    Returns the node of the full path (``None`` if no mount point lies below
+    the deepest match) and the file system type of the deepest match.
+
+    """
+    if _cifs_trie is None:
+        refresh_cifs_table()
+    # mount points are absolute, so relative paths never match
+    if not path.startswith("/"):
+        return None, None
+    # Only the deepest match (most recent parent) counts
+    node = _cifs_trie
+    fstype = node.get(None)
+    for part in path.split("/"):
+        if not part:
+            continue
+        node = node.get(part)
+        if node is None:
+            break
+        fstype = node.get(None, fstype)
+    return node, fstype
 
 
 def copyfile(
@@ -222,6 +444,7 @@ def copyfile(
     create_new=False,
     use_hardlink=True,
     copy_related_files=True,
+    on_cifs_checked=False,
 ):
     """
     Copy or link files.
@@ -267,14 +490,15 @@ def copyfile(
     copy_related_files : Bool
         specifies whether to also operate on related files, as defined in
         ``related_filetype_sets``
+    on_cifs_checked : Bool
+        specifies whether ``copy`` is already set for a destination on CIFS,
+        so the destination doesn't have to be checked again
 
     Returns
     -------
     None
 
     """
-    newhash = None
-    orighash = None
     logger.debug(newfile)
 
     if create_new:
@@ -290,7 +514,7 @@ def copyfile(
             newfile = base + os.sep + fname + ext
 
     # Don't try creating symlinks on CIFS
-    if copy is False and on_cifs(newfile):
+    if copy is False and not on_cifs_checked and on_cifs(newfile):
         copy = True
 
     keep = False
@@ -307,10 +531,8 @@ def copyfile(
         elif posixpath.samefile(newfile, originalfile):
             keep = True
         else:
-            newhash = hash_file(newfile)
-            logger.debug("File: %s already exists,%s, copy:%d", newfile, newhash, copy)
-            orighash = hash_file(originalfile)
-            keep = newhash == orighash
+            logger.debug("File: %s already exists, copy:%d", newfile, copy)
+            keep = _files_equal(newfile, originalfile)
         if keep:
             logger.debug(
                 "File: %s already exists, not overwriting, copy:%d", newfile, copy
@@ -318,31 +540,31 @@ def copyfile(
         else:
             os.unlink(newfile)
 
-    if not keep and use_hardlink:
-        try:
-            logger.debug("Linking File: %s->%s", newfile, originalfile)
-            # Use realpath to avoid hardlinking symlinks
-            os.link(op.realpath(originalfile), newfile)
-        except OSError:
-            use_hardlink = False  # Disable hardlink for associated files
-        else:
-            keep = True
-
-    if not keep and not copy and os.name == "posix":
-        try:
-            logger.debug("Symlinking File: %s->%s", newfile, originalfile)
-            os.symlink(originalfile, newfile)
-        except OSError:
-            copy = True  # Disable symlink for associated files
-        else:
-            keep = True
-
     if not keep:
-        try:
-            logger.debug("Copying File: %s->%s", newfile, originalfile)
-            shutil.copyfile(originalfile, newfile)
-        except shutil.Error as e:
-            logger.warning(e.message)
+        # Strategies are tried in order of preference until one succeeds
+        strategies = []
+        if use_hardlink:
+            # Use realpath to avoid hardlinking symlinks
+            strategies.append(("link", os.link, op.realpath(originalfile)))
+        if not copy and os.name == "posix":
+            strategies.append(("symlink", os.symlink, originalfile))
+        strategies.append(("copy", shutil.copyfile, originalfile))
+        for name, strategy, source in strategies:
+            logger.debug("%s File: %s->%s", name.capitalize(), newfile, originalfile)
+            try:
+                strategy(source, newfile)
+            except shutil.Error as e:
+                logger.warning(e)
+                break
+            except OSError:
+                if name == "link":
+                    use_hardlink = False  # Disable hardlink for associated files
+                elif name == "symlink":
+                    copy = True  # Disable symlink for associated files
+                else:
+                    raise
+            else:
+                break
 
     # Associated files
     if copy_related_files:
@@ -358,6 +580,7 @@ def copyfile(
                     copy,
                     use_hardlink=use_hardlink,
                     copy_related_files=False,
+                    on_cifs_checked=True,
                 )
 
     return newfile
@@ -411,17 +634,31 @@ def copyfiles(filelist, dest, copy=False, create_new=False):
     None
 
     """
-    outfiles = ensure_list(dest)
+    outfiles = ensure_list(dest, tuple2list=True)
+    filelist = ensure_list(filelist, tuple2list=True)
+    destfiles = {}
+    for i, f in enumerate(filelist):
+        if not isinstance(f, list):
+            if len(outfiles) > 1:
+                destfiles[i] = outfiles[i]
+            else:
+                destfiles[i] = fname_presuffix(f, newpath=outfiles[0])
+    # Don't try creating symlinks on CIFS, checked for all destinations at once
+    dest_on_cifs = {}
+    if copy is False:
+        dest_on_cifs = dict(zip(destfiles.keys(), on_cifs_bulk(destfiles.values())))
     newfiles = []
-    for i, f in enumerate(ensure_list(filelist)):
+    for i, f in enumerate(filelist):
         if isinstance(f, list):
             newfiles.insert(i, copyfiles(f, dest, copy=copy, create_new=create_new))
         else:
-            if len(outfiles) > 1:
-                destfile = outfiles[i]
-            else:
-                destfile = fname_presuffix(f, newpath=outfiles[0])
-            destfile = copyfile(f, destfile, copy, create_new=create_new)
+            destfile = copyfile(
+                f,
+                destfiles[i],
+                copy or dest_on_cifs[i],
+                create_new=create_new,
+                on_cifs_checked=True,
+            )
             newfiles.insert(i, destfile)
     return newfiles
 
@@ -450,18 +687,6 @@ def is_container(item):
     return False
 
 
-def ensure_list(filename):
-    """Return a list given either a string or a list."""
-    if isinstance(filename, (str, bytes)):
-        return [filename]
-    elif isinstance(filename, list):
-        return filename
-    elif is_container(filename):
-        return [x for x in filename]
-
-    return None
-
-
 # not sure if this might be useful for Function Task
 def copyfile_input(inputs, output_dir):
     """Implement the base class method."""
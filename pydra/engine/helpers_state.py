@@ -2,7 +2,8 @@
 
 import attr
 import itertools
-from functools import reduce
+from collections import defaultdict
+from functools import lru_cache, reduce
 from copy import deepcopy
 import logging
 from .helpers import ensure_list
@@ -187,16 +188,12 @@ def converter_groups_to_input(group_for_inputs):
         TODO
 
     """
-    input_for_axis = {}
-    ngr = 0
+    input_for_axis = defaultdict(list)
     for inp, grs in group_for_inputs.items():
         for gr in ensure_list(grs):
-            if gr in input_for_axis.keys():
-                input_for_axis[gr].append(inp)
-            else:
-                ngr += 1
-                input_for_axis[gr] = [inp]
-    return input_for_axis, ngr
+            input_for_axis[gr].append(inp)
+    # a plain dictionary is returned, so missing groups are not created on lookup
+    return dict(input_for_axis), len(input_for_axis)
 
 
 # function used in State if combiner
@@ -343,23 +340,21 @@ op = {".": zip, "*": itertools.product}
 def flatten(vals, cur_depth=0, max_depth=None):
     """Flatten a list of values."""
     if max_depth is None:
-        max_depth = len(list(input_shape(vals)))
-    values = []
+        max_depth = len(input_shape(vals))
     if cur_depth >= max_depth:
-        values.append([vals])
-    else:
-        for val in vals:
-            if isinstance(val, (list, tuple)):
-                values.append(flatten(val, cur_depth + 1, max_depth))
-            else:
-                values.append([val])
-    return itertools.chain.from_iterable(values)
+        yield vals
+        return
+    for val in vals:
+        if isinstance(val, (list, tuple)):
+            yield from flatten(val, cur_depth + 1, max_depth)
+        else:
+            yield val
 
 
 def iter_splits(iterable, keys):
     """Generate splits."""
-    for iter in list(iterable):
-        yield dict(zip(keys, list(flatten(iter, max_depth=1000))))
+    for iter in iterable:
+        yield dict(zip(keys, flatten(iter, max_depth=1000)))
 
 
 def input_shape(in1):
@@ -729,8 +724,12 @@ def combine_final_groups(combiner, groups, groups_stack, keys):
 
 def map_splits(split_iter, inputs):
     """Get a dictionary of prescribed splits."""
+    flat_inputs = {}
     for split in split_iter:
-        yield {k: list(flatten(ensure_list(inputs[k])))[v] for k, v in split.items()}
+        for k in split:
+            if k not in flat_inputs:
+                flat_inputs[k] = list(flatten(ensure_list(inputs[k])))
+        yield {k: flat_inputs[k][v] for k, v in split.items()}
 
 
 # Functions for merging and completing splitters in states.
@@ -839,9 +838,15 @@ def _left_right_check(splitter_part, other_states):
 
 def inputs_types_to_dict(name, inputs):
     """Convert type.Inputs to dictionary."""
-    # dj: any better option?
-    input_names = [field for field in attr.asdict(inputs) if field != "_func"]
-    inputs_dict = {}
-    for field in input_names:
-        inputs_dict["{}.{}".format(name, field)] = getattr(inputs, field)
-    return inputs_dict
+    input_keys = _input_keys(name, type(inputs))
+    return {key: getattr(inputs, field) for field, key in input_keys}
+
+
+@lru_cache(maxsize=256)
+def _input_keys(name, inputs_klass):
+    """Return pairs of input field names and keys (with the task name)."""
+    return tuple(
+        (field.name, "{}.{}".format(name, field.name))
+        for field in attr.fields(inputs_klass)
+        if field.name != "_func"
+    )
@@ -1,5 +1,8 @@
 """Task I/O specifications."""
 import attr
+from functools import lru_cache
+from itertools import count
+from operator import attrgetter
 from pathlib import Path
 import typing as ty
 
@@ -16,6 +19,9 @@ class Directory:
     """An :obj:`os.pathlike` object, designating a folder."""
 
 
+_spec_versions = count()
+
+
 @attr.s(auto_attribs=True, kw_only=True)
 class SpecInfo:
     """Base data structure for metadata of specifications."""
@@ -32,6 +38,12 @@ class SpecInfo:
 class BaseSpec:
     """The base dataclass specs for all inputs and outputs."""
 
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        # every change gets a new (unique) version, used to cache values derived
+        # from the fields without hashing them
+        super().__setattr__("_spec_version", next(_spec_versions))
+
     def collect_additional_outputs(self, input_spec, inputs, output_dir):
         """Get additional outputs."""
         return {}
@@ -62,14 +74,26 @@ class BaseSpec:
 
     def retrieve_values(self, wf, state_index=None):
         """Get values contained by this spec."""
+        temp_values = self._lazy_values(wf, attr_fields(self), state_index=state_index)
+        for field, value in temp_values.items():
+            setattr(self, field, value)
+
+    def _lazy_values(self, wf, fields, state_index=None):
+        """Get values of the fields (from the list provided) that are lazy."""
         temp_values = {}
-        for field in attr_fields(self):
+        node_results = {}
+        for field in fields:
             value = getattr(self, field.name)
             if isinstance(value, LazyField):
-                value = value.get_value(wf, state_index=state_index)
+                if value.attr_type == "output":
+                    if value.name not in node_results:
+                        node = getattr(wf, value.name)
+                        node_results[value.name] = node.result(state_index=state_index)
+                    value = value.get_value_from_result(node_results[value.name])
+                else:
+                    value = value.get_value(wf, state_index=state_index)
                 temp_values[field.name] = value
-        for field, value in temp_values.items():
-            setattr(self, field, value)
+        return temp_values
 
     def check_metadata(self):
         """Check contained metadata."""
@@ -114,15 +138,21 @@ class Result:
 
     def __setstate__(self, state):
         if "output_spec" in state:
-            spec = list(state["output_spec"])
-            del state["output_spec"]
-            klass = attr.make_class(
-                spec[0], {k: attr.ib(type=v) for k, v in list(spec[1])}
-            )
+            name, fields = state.pop("output_spec")
+            try:
+                klass = _output_klass(name, fields)
+            except TypeError:  # unhashable field types can't be cached
+                klass = _output_klass.__wrapped__(name, fields)
             state["output"] = klass(**state["output"])
         self.__dict__.update(state)
 
 
+@lru_cache(maxsize=256)
+def _output_klass(name, fields):
+    """Create (once) the output class of loaded results."""
+    return attr.make_class(name, {k: attr.ib(type=v) for k, v in fields})
+
+
 @attr.s(auto_attribs=True, kw_only=True)
 class RuntimeSpec:
     """
@@ -168,14 +198,13 @@ class ShellSpec(BaseSpec):
 
     def retrieve_values(self, wf, state_index=None):
         """Parse output results."""
-        temp_values = {}
-        for field in attr_fields(self):
-            # retrieving values that do not have templates
-            if not field.metadata.get("output_file_template"):
-                value = getattr(self, field.name)
-                if isinstance(value, LazyField):
-                    value = value.get_value(wf, state_index=state_index)
-                    temp_values[field.name] = value
+        # retrieving values that do not have templates
+        fields = [
+            field
+            for field in attr_fields(self)
+            if not field.metadata.get("output_file_template")
+        ]
+        temp_values = self._lazy_values(wf, fields, state_index=state_index)
         for field, value in temp_values.items():
             value = path_to_string(value)
             setattr(self, field, value)
@@ -474,28 +503,24 @@ class LazyField:
         elif self.attr_type == "output":
             node = getattr(wf, self.name)
             result = node.result(state_index=state_index)
-            if isinstance(result, list):
-                if len(result) and isinstance(result[0], list):
-                    results_new = []
-                    for res_l in result:
-                        if self.field == "all_":
-                            res_l_new = [attr.asdict(res.output) for res in res_l]
-                        else:
-                            res_l_new = [
-                                getattr(res.output, self.field) for res in res_l
-                            ]
-                        results_new.append(res_l_new)
-                    return results_new
-                else:
-                    if self.field == "all_":
-                        return [attr.asdict(res.output) for res in result]
-                    else:
-                        return [getattr(res.output, self.field) for res in result]
+            return self.get_value_from_result(result)
+
+    def get_value_from_result(self, result):
+        """Return the value of a lazy output field, given the result(s) of its node."""
+        if self.field == "all_":
+
+            def get_output(res):
+                return attr.asdict(res.output)
+
+        else:
+            get_output = attrgetter(f"output.{self.field}")
+        if isinstance(result, list):
+            if len(result) and isinstance(result[0], list):
+                return [list(map(get_output, res_l)) for res_l in result]
             else:
-                if self.field == "all_":
-                    return attr.asdict(result.output)
-                else:
-                    return getattr(result.output, self.field)
+                return list(map(get_output, result))
+        else:
+            return get_output(result)
 
 
 def donothing(*args, **kwargs):
@@ -442,25 +442,26 @@ class State:
             # NOW TODO: move to init?
             self.ind_l_final = values
             self.keys_final = keys_out
-            # groups after combiner
-            ind_map = {
-                tuple(hlpst.flatten(tup, max_depth=10)): ind
-                for ind, tup in enumerate(self.ind_l_final)
-            }
+            ind_flat_final = [
+                tuple(hlpst.flatten(tup, max_depth=1000)) for tup in self.ind_l_final
+            ]
+            ind_map = {ind_f: ind for ind, ind_f in enumerate(ind_flat_final)}
             self.final_combined_ind_mapping = {
                 i: [] for i in range(len(self.ind_l_final))
             }
+            keys_final = self.keys_final
             for ii, st in enumerate(self.states_ind):
-                ind_f = tuple([st[k] for k in self.keys_final])
+                ind_f = tuple(map(st.__getitem__, keys_final))
                 self.final_combined_ind_mapping[ind_map[ind_f]].append(ii)
+            self.states_ind_final = [
+                dict(zip(keys_final, ind_f)) for ind_f in ind_flat_final
+            ]
         else:
             self.ind_l_final = values
             self.keys_final = keys_out
             # should be 0 or None?
             self.final_combined_ind_mapping = {0: list(range(len(self.states_ind)))}
-        self.states_ind_final = list(
-            hlpst.iter_splits(self.ind_l_final, self.keys_final)
-        )
+            self.states_ind_final = []
 
     def prepare_states_val(self):
         """Evaluate states values having states indices."""
@@ -45,15 +45,25 @@ class Submitter:
         if is_workflow(runnable):
             for nd in runnable.graph.nodes:
                 runnable.create_connections(nd)
-                if nd.allow_cache_override:
+                if nd.allow_cache_override and nd.cache_dir != runnable.cache_dir:
                     nd.cache_dir = runnable.cache_dir
             runnable.inputs._graph_checksums = [
                 nd.checksum for nd in runnable.graph_sorted
             ]
-        if is_workflow(runnable) and runnable.state is None:
-            self.loop.run_until_complete(self.submit_workflow(runnable, rerun=rerun))
-        else:
-            self.loop.run_until_complete(self.submit(runnable, wait=True, rerun=rerun))
+            # the workflow doesn't have to create the connections again
+            runnable._connections_ready = True
+        try:
+            if is_workflow(runnable) and runnable.state is None:
+                self.loop.run_until_complete(
+                    self.submit_workflow(runnable, rerun=rerun)
+                )
+            else:
+                self.loop.run_until_complete(
+                    self.submit(runnable, wait=True, rerun=rerun)
+                )
+        finally:
+            if is_workflow(runnable):
+                runnable._connections_ready = False
         if is_workflow(runnable):
             # resetting all connections with LazyFields
             runnable._reset()
@@ -143,7 +153,9 @@ class Submitter:
         graph_copy = wf.graph.copy()
         # keep track of pending futures
         task_futures = set()
-        while not wf.done_all_tasks or len(task_futures):
+        # tasks that are done are not checked again in the following iterations
+        tasks_not_done = wf._tasks_not_done(wf.graph.nodes)
+        while tasks_not_done or len(task_futures):
             tasks = get_runnable_tasks(graph_copy)
             if not tasks and not task_futures:
                 raise Exception("Nothing queued or todo - something went wrong")
@@ -160,6 +172,7 @@ class Submitter:
                     for fut in await self.submit(task, rerun=rerun):
                         task_futures.add(fut)
             task_futures = await self.worker.fetch_finished(task_futures)
+            tasks_not_done = wf._tasks_not_done(tasks_not_done)
         return wf
 
     def __enter__(self):
@@ -183,31 +196,35 @@ class Submitter:
 def get_runnable_tasks(graph):
     """Parse a graph and return all runnable tasks."""
     tasks = []
-    to_remove = []
-    for tsk in graph.sorted_nodes:
+    tasks_names = set()
+    for tsk in graph.iter_sorted_nodes():
         # since the list is sorted (breadth-first) we can stop
         # when we find a task that depends on any task that is already in tasks
-        if set(graph.predecessors[tsk.name]).intersection(set(tasks)):
+        if any(pred.name in tasks_names for pred in graph.predecessors[tsk.name]):
             break
         if is_runnable(graph, tsk):
             tasks.append(tsk)
-            to_remove.append(tsk)
+            tasks_names.add(tsk.name)
     # removing tasks that are ready to run from the graph
-    for nd in to_remove:
-        graph.remove_nodes(nd)
+    if tasks:
+        graph.remove_nodes(tasks)
     return tasks
 
 
 def is_runnable(graph, obj):
     """Check if a task within a graph is runnable."""
     connections_to_remove = []
+    is_done = True
     for pred in graph.predecessors[obj.name]:
-        is_done = pred.done
-        if not is_done:
-            return False
-        else:
+        if not pred.done:
+            is_done = False
+            break
+        # a node that is done can be still in the graph (it wasn't sent to run),
+        # only connections of the nodes that were removed can be removed
+        if graph.is_wip(pred):
             connections_to_remove.append(pred)
-    # removing nodes that are done from connections
+    # removing nodes that are done from connections,
+    # also if the task has to wait for other nodes, so they are not checked again
     for nd in connections_to_remove:
         graph.remove_nodes_connections(nd)
-    return True
+    return is_done
@@ -324,8 +324,9 @@ class ShellCommandTask(TaskBase):
             # if f.metadata.get("copyfile") in [True, False]:
             #    value = str(self.inputs.map_copyfiles[f.name])
             # else:
-            if self.state and f"{self.name}.{f.name}" in state_ind:
-                value = getattr(self.inputs, f.name)[state_ind[f"{self.name}.{f.name}"]]
+            state_key = self._input_state_keys.get(f.name)
+            if self.state and state_key in state_ind:
+                value = getattr(self.inputs, f.name)[state_ind[state_key]]
             else:
                 value = getattr(self.inputs, f.name)
             if is_local_file(f):
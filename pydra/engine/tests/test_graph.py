@@ -73,6 +73,22 @@ def test_edges_ecxeption_2():
     assert "can't be added" in str(excinfo.value)
 
 
+def test_edges_ecxeption_3():
+    graph = DiGraph(nodes=[A, B], edges=[(A, B)])
+    with pytest.raises(Exception) as excinfo:
+        graph.add_edges((B, C))
+    assert "can't be added" in str(excinfo.value)
+    assert graph.edges_names == [("a", "b")]
+
+
+def test_add_nodes_exception():
+    graph = DiGraph(nodes=[A, B])
+    with pytest.raises(Exception) as excinfo:
+        graph.add_nodes([C, A])
+    assert "repeated elements" in str(excinfo.value)
+    assert [nd.name for nd in graph.nodes] == ["a", "b"]
+
+
 def test_sort_1():
     """a -> b"""
     graph = DiGraph(nodes=[A, B], edges=[(A, B)])
@@ -155,6 +171,18 @@ def test_sort_5b():
     assert graph.sorted_nodes_names == ["a", "d", "b", "c"]
 
 
+def test_sort_5c():
+    """a-> b -> c; a -> c; d -> c (sorting after all of the changes)"""
+    graph = DiGraph(nodes=[A, C, D], edges=[(A, C), (D, C)])
+    assert graph.sorted_nodes_names == ["a", "d", "c"]
+
+    graph.add_nodes(B)
+    graph.add_edges([(A, B), (B, C)])
+    # the graph is not sorted until the sorted nodes are needed
+    assert graph._sorted_nodes is None
+    assert graph.sorted_nodes_names == ["a", "d", "b", "c"]
+
+
 def test_sort_6():
     """a -> b -> c -> e; a -> c -> e; a -> b -> d -> e"""
     graph = DiGraph(
@@ -174,6 +202,49 @@ def test_sort_6():
     assert graph.sorted_nodes_names == ["a", "b", "d", "c", "e"]
 
 
+def test_sort_chain():
+    """long chain of nodes given in reversed order"""
+    nodes = [ObjTest(f"n{i}") for i in range(200)]
+    edges = list(zip(nodes[:-1], nodes[1:]))
+    graph = DiGraph(nodes=nodes[::-1], edges=edges)
+    assert graph.sorted_nodes == nodes
+
+
+def test_iter_sorted_nodes():
+    """a-> b -> c; a -> c; d -> c"""
+    graph = DiGraph(nodes=[C, B, D, A], edges=[(A, B), (B, C), (A, C), (D, C)])
+    nodes_iter = graph.iter_sorted_nodes()
+    assert next(nodes_iter).name == "d"
+    # the graph is not sorted until the whole list is needed
+    assert graph._sorted_nodes is None
+    assert [nd.name for nd in nodes_iter] == ["a", "b", "c"]
+    assert graph.sorted_nodes_names == ["d", "a", "b", "c"]
+    assert [nd.name for nd in graph.iter_sorted_nodes()] == ["d", "a", "b", "c"]
+
+
+def test_sort_cycle():
+    """a -> b -> a"""
+    graph = DiGraph(nodes=[A, B], edges=[(A, B), (B, A)])
+    with pytest.raises(Exception, match="cycle"):
+        graph.sorting()
+
+
+def test_replace_node():
+    """a -> b -> c, b is replaced"""
+    graph = DiGraph(nodes=[A, B, C], edges=[(A, B), (B, C)])
+    assert graph.sorted_nodes_names == ["a", "b", "c"]
+    B_new = ObjTest("b")
+    graph.replace_node(B, B_new)
+    assert graph.nodes == [A, B_new, C]
+    assert graph.edges == []
+    assert graph.predecessors == {"a": [], "b": [], "c": []}
+    assert graph.successors == {"a": [], "b": [], "c": []}
+    graph.add_edges([(C, B_new)])
+    assert graph.sorted_nodes == [A, C, B_new]
+    with pytest.raises(Exception):
+        graph.replace_node(B, B_new)
+
+
 def test_remove_1():
     """a -> b (removing a node)"""
     graph = DiGraph(nodes=[A, B], edges=[(A, B)])
@@ -188,12 +259,14 @@ def test_remove_1():
     assert set(graph.nodes_names_map.keys()) == {"b"}
     assert graph.edges_names == [("a", "b")]
     assert graph.sorted_nodes_names == ["b"]
+    assert graph.is_wip(A) and not graph.is_wip(B)
 
     # removing all connections (e.g. after the task is done)
     graph.remove_nodes_connections(A)
     assert set(graph.nodes_names_map.keys()) == {"b"}
     assert graph.edges_names == []
     assert graph.sorted_nodes_names == ["b"]
+    assert not graph.is_wip(A)
 
 
 def test_remove_2():
@@ -378,6 +451,22 @@ def test_maxpath_5():
     assert graph.max_paths["d"] == {"b": 1, "c": 2}
 
 
+def test_maxpath_diamonds():
+    """a chain of 30 diamonds, with 2**30 paths from the first to the last node"""
+    nodes = [ObjTest("n0")]
+    edges = []
+    for i in range(30):
+        left, right = ObjTest(f"l{i}"), ObjTest(f"r{i}")
+        last = ObjTest(f"n{i + 1}")
+        edges += [(nodes[-1], left), (nodes[-1], right), (left, last), (right, last)]
+        nodes += [left, right, last]
+    graph = DiGraph(nodes=nodes, edges=edges)
+    graph.calculate_max_paths()
+    assert list(graph.max_paths.keys()) == ["n0"]
+    assert graph.max_paths["n0"]["n30"] == 60
+    assert graph.max_paths["n0"]["l29"] == 59
+
+
 def test_copy_1():
     """a -> b"""
     graph = DiGraph(nodes=[B, A], edges=[(A, B)])
@@ -388,3 +477,15 @@ def test_copy_1():
     assert id(graph.nodes[0]) == id(graph_copy.nodes[0])
     assert graph.edges == graph_copy.edges
     assert id(graph.edges) != (graph_copy.edges)
+
+
+def test_copy_2():
+    """a -> b -> c, a -> c (removing connections from the copy)"""
+    graph = DiGraph(nodes=[A, B, C], edges=[(A, B), (B, C), (A, C)])
+    graph_copy = graph.copy()
+    graph_copy.remove_nodes(A)
+    assert graph_copy.is_wip(A) and not graph.is_wip(A)
+    graph_copy.remove_nodes_connections(A)
+    assert graph_copy.edges_names == [("b", "c")]
+    # the original graph is not changed
+    assert graph.edges_names == [("a", "b"), ("b", "c"), ("a", "c")]
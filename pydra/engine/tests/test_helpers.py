@@ -1,11 +1,18 @@
+from copy import deepcopy
+from hashlib import sha256
 from pathlib import Path
+import pickle
+import subprocess as sp
+import sys
 
+import attr
 import pytest
 import cloudpickle as cp
 
 from .utils import multiply
 from .. import helpers
 from .. import helpers_file
+from ..specs import Result
 
 
 def test_save(tmpdir):
@@ -32,6 +39,102 @@ def test_save(tmpdir):
     assert res.output.out == 2
 
 
+def test_save_cloudpickle_fallback(tmpdir):
+    outdir = Path(tmpdir)
+    foo = multiply(name="mult", x=1, y=2)
+    # lambdas can't be pickled by the standard library pickler
+    foo.hooks.pre_run = lambda task: task.name
+    helpers.save(outdir, task=foo)
+    del foo
+    foo = cp.loads((outdir / "_task.pklz").read_bytes())
+    assert foo.hooks.pre_run(foo) == "mult"
+
+
+def test_save_main_references(tmpdir):
+    outdir = Path(tmpdir)
+    script = outdir / "script.py"
+    script.write_text(
+        "from pathlib import Path\n"
+        "from pydra.engine import helpers\n"
+        "from pydra.engine.tests.utils import multiply\n"
+        "def my_hook(task):\n"
+        "    return task.name\n"
+        "foo = multiply(name='mult', x=1, y=2)\n"
+        "foo.hooks.pre_run = my_hook\n"
+        f"helpers.save(Path({str(outdir)!r}), task=foo)\n"
+        f"Path({str(outdir / 'hook.pkl')!r}).write_bytes(helpers._dumps(my_hook))\n"
+    )
+    pydra_path = str(Path(helpers.__file__).parents[2])
+    sp.run([sys.executable, str(script)], check=True, env={"PYTHONPATH": pydra_path})
+    # functions from the script's __main__ are stored by value
+    foo = helpers.load_task(outdir / "_task.pklz")
+    assert foo.hooks.pre_run(foo) == "mult"
+    my_hook = helpers._loads((outdir / "hook.pkl").read_bytes())
+    assert my_hook(foo) == "mult"
+
+
+def test_dumps_main_string(monkeypatch):
+    # values that only contain the string "__main__" don't need cloudpickle
+    monkeypatch.setattr(helpers, "cp", None)
+    obj = {"__main__": ["/tmp/__main__.py", "__main__"]}
+    assert helpers._loads(helpers._dumps(obj)) == obj
+
+
+def test_save_compressed(tmpdir, monkeypatch):
+    pytest.importorskip("lz4")
+    monkeypatch.setattr(helpers, "PYDRA_COMPRESS", True)
+    outdir = Path(tmpdir)
+    foo = multiply(name="mult", x=1, y=2)
+    res = foo()
+    helpers.save(outdir, result=res, task=foo)
+    assert (outdir / "_result.pklz").read_bytes()[:4] == helpers._LZ4_MAGIC
+    foo = helpers.load_task(outdir / "_task.pklz")
+    assert foo.inputs.x == 1 and foo.inputs.y == 2
+    res = helpers.load_result(outdir.name, [outdir.parent])
+    assert res.output.out == 2
+
+
+@pytest.mark.skipif(
+    pickle.HIGHEST_PROTOCOL < 5, reason="out-of-band buffers need pickle protocol 5"
+)
+def test_save_out_of_band(tmpdir, monkeypatch):
+    np = pytest.importorskip("numpy")
+    monkeypatch.setattr(helpers, "_OUT_OF_BAND_MIN_SIZE", 1000)
+    outdir = Path(tmpdir)
+    Output = attr.make_class("Output", ["small", "large"])
+    res = Result(output=Output(small=np.arange(10), large=np.arange(1000)))
+    # by default the result file is self-contained
+    helpers.save(outdir, result=res)
+    assert not (outdir / "_result.buffers").exists()
+    monkeypatch.setattr(helpers, "PYDRA_OUT_OF_BAND", True)
+    helpers.save(outdir, result=res)
+    assert [el.name for el in (outdir / "_result.buffers").iterdir()] == ["000.bin"]
+    res = helpers.load_result(outdir.name, [outdir.parent])
+    assert (res.output.large == np.arange(1000)).all()
+    assert (res.output.small == np.arange(10)).all()
+    res.output.large[0] = 1  # arrays are writable
+    # saving a result without large buffers removes the stale ones
+    helpers.save(outdir, result=Result(output=Output(small=1, large=2)))
+    assert not (outdir / "_result.buffers").exists()
+    assert helpers.load_result(outdir.name, [outdir.parent]).output.large == 2
+
+
+def test_load_result(tmpdir):
+    cache1, cache2 = Path(tmpdir) / "cache1", Path(tmpdir) / "cache2"
+    assert helpers.load_result("checksum", [cache1, cache2]) is None
+    assert not helpers.result_exists("checksum", [cache1, cache2])
+    # an unfinished task in the first location doesn't hide later results
+    (cache1 / "checksum").mkdir(parents=True)
+    helpers.save(cache2 / "checksum", result=Result(output=None))
+    assert helpers.load_result("checksum", [cache1, cache2]).errored is False
+    assert helpers.result_exists("checksum", [cache1, cache2])
+    assert helpers.load_result("checksum", [str(cache2)]).errored is False
+    # an empty result file is still being written
+    (cache1 / "checksum" / "_result.pklz").touch()
+    assert helpers.load_result("checksum", [cache1, cache2]) is None
+    assert not helpers.result_exists("checksum", [cache1, cache2])
+
+
 def test_create_pyscript(tmpdir):
     outdir = Path(tmpdir)
     with pytest.raises(Exception):
@@ -40,6 +143,23 @@ def test_create_pyscript(tmpdir):
     helpers.save(outdir, task=foo)
     pyscript = helpers.create_pyscript(outdir, foo.checksum)
     assert pyscript.exists()
+    content = pyscript.read_text()
+    assert f'cache_path = Path("{outdir}")' in content
+    assert "task(rerun=False)" in content
+
+
+def test_execute(capfd):
+    code = "import sys; print('out'); print('err', file=sys.stderr)"
+    cmd = [sys.executable, "-c", code]
+    rc, stdout, stderr = helpers.execute(cmd)
+    assert rc == 0
+    assert stdout == "out\n"
+    assert stderr == "err\n"
+    # the output is also displayed while the process runs
+    captured = capfd.readouterr()
+    assert captured.out == "out\n" and captured.err == "err\n"
+    rc, stdout, _ = helpers.execute([sys.executable, "-c", "exit(3)"], strip=True)
+    assert rc == 3 and stdout == ""
 
 
 def test_hash_file(tmpdir):
@@ -50,3 +170,108 @@ def test_hash_file(tmpdir):
         helpers_file.hash_file(outdir / "test.file")
         == "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08"
     )
+
+
+def test_hash_file_large(tmpdir):
+    outdir = Path(tmpdir)
+    content = bytes(range(256)) * 10000
+    (outdir / "large.file").write_bytes(content)
+    (outdir / "empty.file").write_bytes(b"")
+    assert (
+        helpers_file.hash_file(outdir / "large.file", chunk_len=1000)
+        == sha256(content).hexdigest()
+    )
+    assert helpers_file.hash_file(outdir / "empty.file") == sha256().hexdigest()
+
+
+def test_hash_file_list(tmpdir):
+    outdir = Path(tmpdir)
+    files = []
+    for i in range(10):
+        (outdir / f"file_{i}.txt").write_text(f"content {i}")
+        files.append(outdir / f"file_{i}.txt")
+    expected = helpers.hash_function([helpers_file.hash_file(el) for el in files])
+    assert helpers_file.hash_file(files) == expected
+    assert helpers_file.hash_file(files[::-1]) != expected
+    # nested lists keep their structure in the hash
+    nested = [files[0], [files[1], [files[2], files[3]]]]
+    expected = helpers.hash_function(
+        [
+            helpers_file.hash_file(files[0]),
+            helpers.hash_function(
+                [
+                    helpers_file.hash_file(files[1]),
+                    helpers.hash_function(
+                        [helpers_file.hash_file(el) for el in files[2:4]]
+                    ),
+                ]
+            ),
+        ]
+    )
+    assert helpers_file.hash_file(nested) == expected
+
+
+def test_gather_runtime_info(tmpdir):
+    prof = Path(tmpdir) / "proc.log"
+    prof.write_text(
+        "1.0,10.000000,1024.000000,2048.000000\n"
+        "2.0,150.000000,4096.000000,1024.000000\n"
+        "3.0,50.000000,512.000000,512.000000\n"
+    )
+    runtime = helpers.gather_runtime_info(prof)
+    assert runtime.cpu_peak_percent == 150.0
+    assert runtime.rss_peak_gb == 4.0
+    assert runtime.vms_peak_gb == 2.0
+    # the same values are read without numpy
+    assert helpers._prof_peaks_python(prof) == (150.0, 4096.0, 2048.0)
+
+    prof.write_text("")
+    runtime = helpers.gather_runtime_info(prof)
+    assert runtime.rss_peak_gb is None
+    assert helpers._prof_peaks_python(prof) is None
+
+
+@pytest.mark.parametrize(
+    "obj1, obj2",
+    [
+        (1, "1"),
+        (1, 1.0),
+        (1, True),
+        (None, "None"),
+        ([1, 2], (1, 2)),
+        ([[1, 2], 3], [1, [2, 3]]),
+        (["ab", "c"], ["a", "bc"]),
+        ({"a": 1}, {"a": "1"}),
+        (b"abc", "abc"),
+    ],
+)
+def test_hash_function_distinct(obj1, obj2):
+    assert helpers.hash_function(obj1) != helpers.hash_function(obj2)
+
+
+def test_hash_function_stable():
+    obj = {"a": [1, 2.5, None, (True, "x")], "b": {"c": b"\x00"}, "d": Path("/tmp")}
+    assert helpers.hash_function(obj) == helpers.hash_function(deepcopy(obj))
+
+
+def test_hash_function_self_reference():
+    obj1 = [1]
+    obj1.append(obj1)
+    obj2 = [1]
+    obj2.append(obj2)
+    assert helpers.hash_function(obj1) == helpers.hash_function(obj2)
+    # a repeated (not recursive) element is hashed as a regular element
+    obj3 = [1, [1]]
+    assert helpers.hash_function(obj1) != helpers.hash_function(obj3)
+    assert helpers.hash_function([obj3, obj3]) == helpers.hash_function(
+        [[1, [1]], [1, [1]]]
+    )
+    dct = {"a": 1}
+    dct["b"] = dct
+    assert helpers.hash_function(dct) == helpers.hash_function(deepcopy(dct))
+
+
+def test_hash_function_numpy_scalars():
+    np = pytest.importorskip("numpy")
+    assert helpers.hash_function(np.int64(5)) == helpers.hash_function(5)
+    assert helpers.hash_function([np.float64(2.5)]) == helpers.hash_function([2.5])
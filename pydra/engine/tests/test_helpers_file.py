@@ -10,10 +10,15 @@ from ..helpers_file import (
     copyfile,
     copyfiles,
     on_cifs,
+    on_cifs_bulk,
     get_related_files,
     ensure_list,
     _cifs_table,
+    _generate_cifs_table,
     _parse_mount_table,
+    _parse_mountinfo,
+    refresh_cifs_table,
+    _files_equal,
 )
 
 
@@ -31,6 +36,8 @@ def _ignore_atime(stat):
         ("../usr/local/foo.nii", ("../usr/local", "foo", ".nii")),
         ("/usr/local/foo.a.b.c.d", ("/usr/local", "foo.a.b.c", ".d")),
         ("/usr/local/", ("/usr/local", "", "")),
+        ("/usr/local/foo.NII.GZ", ("/usr/local", "foo", ".NII.GZ")),
+        (".nii.gz", ("", ".nii", ".gz")),
     ],
 )
 def test_split_filename(filename, split):
@@ -49,6 +56,15 @@ def test_fname_presuffix():
     assert pth == "/tmp/pre_foo_post"
 
 
+def test_fname_presuffix_relative(tmpdir, monkeypatch):
+    for dirname in ("a", "b"):
+        tmpdir.mkdir(dirname)
+        monkeypatch.chdir(tmpdir.join(dirname))
+        # cached results must follow the working directory
+        pth = fname_presuffix("foo.nii", newpath="out")
+        assert pth == os.path.join(str(tmpdir), dirname, "out", "foo.nii")
+
+
 @pytest.fixture()
 def _temp_analyze_files(tmpdir):
     """Generate temporary analyze file pair."""
@@ -90,6 +106,23 @@ def test_copyfile_true(_temp_analyze_files):
     assert os.path.exists(new_hdr)
 
 
+@pytest.mark.skipif(os.name != "posix", reason="symlinks are only used on posix")
+def test_copyfile_link_fallback(_temp_analyze_files, monkeypatch):
+    orig_img, orig_hdr = _temp_analyze_files
+    pth, fname = os.path.split(orig_img)
+    new_img = os.path.join(pth, "newfile.img")
+    new_hdr = os.path.join(pth, "newfile.hdr")
+
+    def _no_link(src, dst):
+        raise OSError("hardlinks not supported")
+
+    monkeypatch.setattr(os, "link", _no_link)
+    copyfile(orig_img, new_img)
+    # hardlinking fails, so both files fall back to symlinks
+    assert os.path.islink(new_img)
+    assert os.path.islink(new_hdr)
+
+
 def test_copyfiles(_temp_analyze_files, _temp_analyze_files_prime):
     orig_img1, orig_hdr1 = _temp_analyze_files
     orig_img2, orig_hdr2 = _temp_analyze_files_prime
@@ -106,6 +139,22 @@ def test_copyfiles(_temp_analyze_files, _temp_analyze_files_prime):
     assert os.path.exists(new_hdr2)
 
 
+def test_copyfiles_on_cifs_checked_once(_temp_analyze_files, monkeypatch):
+    from .. import helpers_file
+
+    def on_cifs_single(fname):
+        raise AssertionError(f"{fname} checked again")
+
+    # all destinations are checked by copyfiles, not again by copyfile
+    monkeypatch.setattr(helpers_file, "on_cifs", on_cifs_single)
+    orig_img, orig_hdr = _temp_analyze_files
+    new_pth = os.path.join(os.path.dirname(orig_img), "new")
+    os.mkdir(new_pth)
+    copyfiles([orig_img], new_pth)
+    assert os.path.exists(os.path.join(new_pth, os.path.basename(orig_img)))
+    assert os.path.exists(os.path.join(new_pth, os.path.basename(orig_hdr)))
+
+
 def test_linkchain(_temp_analyze_files):
     if os.name is not "posix":
         return
@@ -172,6 +221,25 @@ def test_recopy(_temp_analyze_files):
             os.unlink(new_hdr)
 
 
+def test_files_equal(tmpdir):
+    afile, bfile = tmpdir.join("a.txt"), tmpdir.join("b.txt")
+    afile.write("x" * 2500)
+    bfile.write("x" * 2500)
+    assert _files_equal(str(afile), str(bfile), chunk_len=1000)
+    bfile.write("x" * 2499 + "y")
+    assert not _files_equal(str(afile), str(bfile), chunk_len=1000)
+    bfile.write("x" * 2499)
+    assert not _files_equal(str(afile), str(bfile), chunk_len=1000)
+
+
+def test_copyfile_overwrite_different(tmpdir):
+    orig, new = tmpdir.join("orig.txt"), tmpdir.join("new.txt")
+    orig.write("original content")
+    new.write("different content")
+    copyfile(str(orig), str(new), copy=True, use_hardlink=False)
+    assert new.read() == "original content"
+
+
 def test_get_related_files(_temp_analyze_files):
     orig_img, orig_hdr = _temp_analyze_files
 
@@ -202,11 +270,12 @@ def test_get_related_files_noninclusive(_temp_analyze_files):
         ("foo.nii", ["foo.nii"]),
         (["foo.nii"], ["foo.nii"]),
         (("foo", "bar"), ["foo", "bar"]),
-        (12.34, None),
+        (12.34, [12.34]),
+        (None, []),
     ],
 )
 def test_ensure_list(filename, expected):
-    x = ensure_list(filename)
+    x = ensure_list(filename, tuple2list=True)
     assert x == expected
 
 
@@ -380,6 +449,16 @@ devpts on /dev/ptmx type devpts (rw,nosuid,noexec,relatime,gid=5,mode=620,ptmxmo
         0,
         [],
     ),
+    # Only mounts below a CIFS mount, not sharing a name prefix with it
+    (
+        r"""/dev/sda1 on / type ext4 (rw,relatime)
+//server/share on /mnt/share type cifs (rw,relatime)
+/dev/sdb1 on /mnt/share/local type ext4 (rw,relatime)
+/dev/sdc1 on /mnt/shared type ext4 (rw,relatime)
+""",
+        0,
+        [("/mnt/share/local", "ext4"), ("/mnt/share", "cifs")],
+    ),
 )
 
 
@@ -388,6 +467,22 @@ def test_parse_mount_table(output, exit_code, expected):
     assert _parse_mount_table(exit_code, output) == expected
 
 
+def test_parse_mountinfo():
+    content = """\
+22 1 8:1 / / rw,relatime shared:1 - ext4 /dev/sda1 rw
+35 22 0:32 / /data rw,relatime shared:20 - cifs //10.0.75.1/C rw,vers=3.02
+36 35 8:2 / /data/local rw,relatime - ext4 /dev/sda2 rw
+37 22 0:33 / /mnt/my\\040share rw,relatime - cifs //server/share rw
+38 22 0:34 / /broken rw,relatime
+"""
+    assert _parse_mountinfo(content) == [
+        ("/mnt/my share", "cifs"),
+        ("/data/local", "ext4"),
+        ("/data", "cifs"),
+    ]
+    assert _parse_mountinfo("") == []
+
+
 def test_cifs_check():
     assert isinstance(_cifs_table, list)
     assert isinstance(on_cifs("/"), bool)
@@ -403,14 +498,34 @@ def test_cifs_check():
     ]
 
     orig_table = _cifs_table[:]
-    _cifs_table[:] = []
+    refresh_cifs_table([])
 
     for target, _ in cifs_targets:
         assert on_cifs(target) is False
 
-    _cifs_table.extend(fake_table)
+    refresh_cifs_table(fake_table)
     for target, expected in cifs_targets:
         assert on_cifs(target) is expected
+    targets, expected = zip(*cifs_targets)
+    assert on_cifs_bulk(targets) == list(expected)
+    # relative paths are not matched
+    assert on_cifs("scratch/x") is False
+    assert on_cifs_bulk(["scratch/x", "scratch"]) == [False, False]
+    # mount points themselves
+    assert on_cifs_bulk(["/scratch", "/scratch/tmp", "/scratchy"]) == [
+        True,
+        False,
+        False,
+    ]
 
-    _cifs_table[:] = []
-    _cifs_table.extend(orig_table)
+    refresh_cifs_table(orig_table)
+
+
+def test_refresh_cifs_table():
+    orig_table = _cifs_table[:]
+    refresh_cifs_table([("/scratch", "cifs")])
+    assert on_cifs("/scratch/x") is True
+    assert on_cifs("/scratchy/x") is False
+    refresh_cifs_table()
+    assert _cifs_table == _generate_cifs_table()
+    refresh_cifs_table(orig_table)
@@ -1,3 +1,5 @@
+import attr
+
 from .. import helpers_state as hlpst
 
 import pytest
@@ -658,3 +660,12 @@ def test_connect_splitters(
 def test_connect_splitters_exception(splitter, other_states):
     with pytest.raises(Exception):
         hlpst.connect_splitters(splitter, other_states, state_fields=True)
+
+
+def test_inputs_types_to_dict():
+    Inputs = attr.make_class("Inputs", ["_func", "a", "b"])
+    inputs = Inputs(func=None, a=[1, 2], b=3)
+    assert hlpst.inputs_types_to_dict("NA", inputs) == {"NA.a": [1, 2], "NA.b": 3}
+    inputs.b = 4
+    assert hlpst.inputs_types_to_dict("NA", inputs) == {"NA.a": [1, 2], "NA.b": 4}
+    assert hlpst.inputs_types_to_dict("NB", inputs) == {"NB.a": [1, 2], "NB.b": 4}
@@ -6,6 +6,7 @@ import pytest
 from .utils import fun_addtwo, fun_addvar, moment, fun_div
 
 from ..core import TaskBase
+from ..specs import BaseSpec
 from ..submitter import Submitter
 
 if bool(shutil.which("sbatch")):
@@ -283,6 +284,22 @@ def test_task_init_6():
     assert nn.state.states_val == []
 
 
+def test_task_checksum_states(monkeypatch):
+    nn = fun_addtwo(name="NA").split(splitter="a", a=[3, 5])
+    # the checksums of all elements are calculated (and cached) at once
+    checksum_1 = nn.checksum_states(1)
+    # the checksums are reused until the inputs change, without hashing the inputs
+    monkeypatch.setattr(TaskBase, "_checksum_state_element", None)
+    monkeypatch.setattr(BaseSpec, "hash", None)
+    checksums = nn.checksum_states()
+    assert len(set(checksums)) == 2 and checksums[1] == checksum_1
+    assert nn.checksum_states(0) == checksums[0]
+    monkeypatch.undo()
+    nn.inputs.a = [3, 7]
+    checksums_new = nn.checksum_states()
+    assert checksums_new[0] == checksums[0] and checksums_new[1] != checksums[1]
+
+
 def test_task_error():
     func = fun_div(name="div", a=1, b=0)
     with pytest.raises(ZeroDivisionError):
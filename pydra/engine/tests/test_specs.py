@@ -1,3 +1,5 @@
+import pickle
+import attr
 from pathlib import Path
 import typing as ty
 
@@ -21,7 +23,7 @@ import pytest
 def test_basespec():
     spec = BaseSpec()
     assert (
-        spec.hash == "44136fa355b3678a1146ad16f7e8649e94fb4fc21fe77e8310c060f61caaff8a"
+        spec.hash == "29cdabad4134b52674ff1c35813875282a1bc1aeba0aa0cffec4990a25a32fa0"
     )
 
 
@@ -138,6 +140,19 @@ def test_lazy_out():
     assert lf.get_value(wf=WorkflowTesting()) == "OUT_A"
 
 
+def test_lazy_out_results():
+    tn = NodeTesting()
+    lf = LazyField(node=tn, attr_type="output")
+    lf.out_a
+    Output = attr.make_class("Output", ["out_a"])
+    res = [Result(output=Output(out_a=i)) for i in range(3)]
+    assert lf.get_value_from_result(res[0]) == 0
+    assert lf.get_value_from_result(res) == [0, 1, 2]
+    assert lf.get_value_from_result([res[:2], res[2:]]) == [[0, 1], [2]]
+    lf.field = "all_"
+    assert lf.get_value_from_result(res[1:]) == [{"out_a": 1}, {"out_a": 2}]
+
+
 def test_laxy_errorattr():
     with pytest.raises(Exception) as excinfo:
         tn = NodeTesting()
@@ -161,7 +176,7 @@ def test_file_hash(tmpdir):
     inputs = make_klass(input_spec)
     assert (
         inputs(in_file=outfile).hash
-        == "1384a1eb11cd94a5b826a82b948313b9237a0956d406ccff59e79ec92b3c935f"
+        == "cc9630839780c4161ea0ab435b68cf46e43af9373da7d4c2ee7d84284c454239"
     )
     with open(outfile, "wt") as fp:
         fp.write("test")
@@ -170,5 +185,33 @@ def test_file_hash(tmpdir):
     inputs = make_klass(input_spec)
     assert (
         inputs(in_file=outfile).hash
-        == "088625131e6718a00170ad445a9c295244dffd4e5d847c8ee4b1606d623dacb1"
+        == "e700b58ceee0b22235f1fe994bd331c65bd2aa217eec7ff2fb5a02175e5279f9"
     )
+
+
+def test_make_klass_cache():
+    spec = SpecInfo(name="Inputs", fields=[("a", int)], bases=(BaseSpec,))
+    klass = make_klass(spec)
+    assert make_klass(spec) is klass
+    # the class has to be recreated when the spec is modified
+    spec.fields.append(("b", int))
+    klass_b = make_klass(spec)
+    assert klass_b is not klass
+    assert [fld.name for fld in attr.fields(klass_b)] == ["a", "b"]
+    # equal specs are different objects, so they don't share the class
+    spec_copy = SpecInfo(name="Inputs", fields=spec.fields[:], bases=(BaseSpec,))
+    assert make_klass(spec_copy) is not klass_b
+
+
+def test_result_pickle():
+    Output = attr.make_class("Output", {"out": attr.ib(type=int)})
+    result = Result(output=Output(out=1))
+    result_1 = pickle.loads(pickle.dumps(result))
+    result_2 = pickle.loads(pickle.dumps(result))
+    assert result_1.output.out == result_2.output.out == 1
+    # the output class is created once for all loaded results
+    assert type(result_1.output) is type(result_2.output)
+    # and without caching if field types can't be hashed
+    Output = attr.make_class("Output", {"out": attr.ib(type=[int])})
+    result = pickle.loads(pickle.dumps(Result(output=Output(out=2))))
+    assert result.output.out == 2
@@ -1,3 +1,4 @@
+import asyncio
 from dateutil import parser
 import re
 import shutil
@@ -6,9 +7,11 @@ import time
 
 import pytest
 
-from .utils import gen_basic_wf
+from .utils import gen_basic_wf, fun_div
 from ..core import Workflow
-from ..submitter import Submitter
+from ..graph import DiGraph
+from ..submitter import Submitter, get_runnable_tasks, is_runnable
+from .. import workers
 from ... import mark
 
 # list of (plugin, available)
@@ -145,6 +148,108 @@ def test_wf_with_state():
     assert res[2].output.out == 5
 
 
+def test_prepare_runscripts_saves_task_once(tmpdir, monkeypatch):
+    saved = []
+    orig_save = workers.save
+
+    def counting_save(*args, **kwargs):
+        saved.append(args)
+        return orig_save(*args, **kwargs)
+
+    monkeypatch.setattr(workers, "save", counting_save)
+    task = sleep_add_one(name="task", x=1, cache_dir=tmpdir)
+    worker = workers.SlurmWorker()
+    script_dir, pyscript, _ = worker._prepare_runscripts(task)
+    assert (script_dir / "_task.pklz").exists()
+    assert pyscript.exists()
+    # the pickled task is reused when the scripts are prepared again
+    worker._prepare_runscripts(task, rerun=True)
+    assert len(saved) == 1
+
+
+def test_fetch_finished_empty():
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(workers.Worker().fetch_finished(set())) == set()
+        worker = workers.DistributedWorker(max_jobs=1)
+        assert loop.run_until_complete(worker.fetch_finished(set())) == set()
+        assert worker._jobs == 0
+    finally:
+        loop.close()
+
+
+class DoneTest:
+    def __init__(self, name, done):
+        self.name = name
+        self.done = done
+
+
+def test_is_runnable_removes_done_predecessors():
+    """a -> c; b -> c; only a is done"""
+    a, b, c = DoneTest("a", True), DoneTest("b", False), DoneTest("c", False)
+    graph = DiGraph(nodes=[a, b, c], edges=[(a, c), (b, c)])
+    assert get_runnable_tasks(graph) == [a, b]
+    assert not is_runnable(graph, c)
+    # a doesn't have to be checked again
+    assert graph.predecessors["c"] == [b]
+    b.done = True
+    assert get_runnable_tasks(graph) == [c]
+
+
+def test_is_runnable_done_predecessor_in_graph():
+    """w -> p -> n; q -> n; p is done, but w isn't"""
+    w, p, q = DoneTest("w", False), DoneTest("p", True), DoneTest("q", False)
+    n = DoneTest("n", False)
+    graph = DiGraph(nodes=[w, p, q, n], edges=[(w, p), (p, n), (q, n)])
+    assert get_runnable_tasks(graph) == [w, q]
+    assert get_runnable_tasks(graph) == []
+    assert graph.predecessors["n"] == [p, q]
+    w.done = q.done = True
+    assert get_runnable_tasks(graph) == [p]
+    assert get_runnable_tasks(graph) == [n]
+
+
+def test_wf_tasks_not_done():
+    wf = Workflow(name="wf", input_spec=["x"])
+    a, b, c = DoneTest("a", True), DoneTest("b", False), DoneTest("c", False)
+    assert wf._tasks_not_done([a, b, c]) == [b, c]
+    assert wf._tasks_not_done([b]) == [b]
+    c.done = True
+    assert wf._tasks_not_done([b, c]) == [b]
+
+
+def test_wf_connections_created_once(tmpdir, monkeypatch):
+    wf = gen_basic_wf()
+    wf.cache_dir = tmpdir
+    connected = []
+    create_connections = wf.create_connections
+
+    def create_connections_spy(task):
+        connected.append(task.name)
+        create_connections(task)
+
+    monkeypatch.setattr(wf, "create_connections", create_connections_spy)
+    with Submitter("cf") as sub:
+        sub(wf)
+    assert wf.result().output.out == 9
+    # the connections created by the submitter are not created again by the wf
+    assert sorted(connected) == sorted(wf.graph.nodes_names_map)
+    assert not wf._connections_ready
+
+
+def test_wf_connections_ready_reset_on_error(tmpdir):
+    wf = Workflow(name="wf", input_spec=["x"], cache_dir=tmpdir)
+    wf.add(fun_div(name="div", a=wf.lzin.x, b=0))
+    wf.set_output([("out", wf.div.lzout.out)])
+    # the workflow itself isn't run, only its state jobs
+    wf.split("x")
+    wf.inputs.x = [1, 2]
+    with pytest.raises(Exception):
+        with Submitter("cf") as sub:
+            sub(wf)
+    assert not wf._connections_ready
+
+
 @pytest.mark.skipif(not plugins["slurm"], reason="slurm not installed")
 def test_slurm_wf(tmpdir):
     wf = gen_basic_wf()
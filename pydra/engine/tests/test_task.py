@@ -3,6 +3,8 @@
 import typing as ty
 import os
 import pytest
+import attr
+import cloudpickle as cp
 
 from ... import mark
 from ..task import (
@@ -12,6 +14,7 @@ from ..task import (
     DockerTask,
     SingularityTask,
 )
+from ..specs import SpecInfo, BaseSpec
 from ...utils.messenger import FileMessenger, PrintMessenger, collect_messages
 from .utils import gen_basic_wf
 
@@ -27,6 +30,24 @@ def test_output():
     assert res.output.out == 5
 
 
+def test_output_names_spec_update():
+    nn = funaddtwo(a=3)
+    assert nn.output_names == ["out"]
+    # extending or replacing the output spec is reflected in the names
+    nn.output_spec.fields.append(("extra", int))
+    assert nn.output_names == ["out", "extra"]
+    nn.output_spec = SpecInfo(name="Output", fields=[("new", int)], bases=(BaseSpec,))
+    assert nn.output_names == ["new"]
+
+
+def test_task_pickle():
+    nn = funaddtwo(a=[1, 2])
+    nn_unpickled = cp.loads(cp.dumps(nn))
+    assert attr.asdict(nn_unpickled.inputs) == attr.asdict(nn.inputs)
+    assert nn_unpickled.inputs._func == nn.inputs._func
+    assert nn_unpickled.checksum == nn.checksum
+
+
 @pytest.mark.xfail(reason="cp.dumps(func) depends on the system/setup, TODO!!")
 def test_checksum():
     nn = funaddtwo(a=3)
@@ -43,6 +43,20 @@ def test_wf_1(plugin):
     assert wf.output_dir.exists()
 
 
+def test_wf_add_same_name(tmpdir):
+    """ a task added again with the same name replaces the previous one"""
+    wf = Workflow(name="wf_1", input_spec=["x"], cache_dir=tmpdir)
+    wf.add(add2(name="add2", x=wf.lzin.x))
+    wf.add(multiply(name="add2", x=wf.lzin.x, y=3))
+    wf.set_output([("out", wf.add2.lzout.out)])
+    wf.inputs.x = 2
+    assert [nd.name for nd in wf.graph.nodes] == ["add2"]
+
+    with Submitter(plugin="cf") as sub:
+        sub(wf)
+    assert wf.result().output.out == 6
+
+
 @pytest.mark.parametrize("plugin", Plugins)
 def test_wf_1a_outpastuple(plugin):
     """ workflow with one task and no splitter
@@ -44,14 +44,10 @@ class Worker:
             Pending asyncio :class:`asyncio.Task`.
 
         """
-        done = set()
-        try:
-            done, pending = await asyncio.wait(
-                futures, return_when=asyncio.FIRST_COMPLETED
-            )
-        except ValueError:
-            # nothing pending!
-            pending = set()
+        if not futures:
+            # nothing pending! (asyncio.wait raises for an empty set)
+            return set()
+        done, pending = await asyncio.wait(futures, return_when=asyncio.FIRST_COMPLETED)
         logger.debug(f"Tasks finished: {len(done)}")
         return pending
 
@@ -71,7 +67,7 @@ class DistributedWorker(Worker):
             task.cache_dir / f"{self.__class__.__name__}_scripts" / task.checksum
         )
         script_dir.mkdir(parents=True, exist_ok=True)
-        if not (script_dir / "_task.pkl").exists():
+        if not (script_dir / "_task.pklz").exists():
             save(script_dir, task=task)
         pyscript = create_pyscript(script_dir, task.checksum, rerun=rerun)
         batchscript = script_dir / f"batchscript_{task.checksum}.sh"
@@ -111,14 +107,11 @@ class DistributedWorker(Worker):
             logger.warning(f"Reducing queued jobs due to max jobs ({self.max_jobs})")
             futures = list(futures)
             futures, unqueued = set(futures[:job_slots]), set(futures[job_slots:])
-        try:
-            self._jobs += len(futures)
-            done, pending = await asyncio.wait(
-                futures, return_when=asyncio.FIRST_COMPLETED
-            )
-        except ValueError:
+        if not futures:
             # nothing pending!
-            pending = set()
+            return unqueued
+        self._jobs += len(futures)
+        done, pending = await asyncio.wait(futures, return_when=asyncio.FIRST_COMPLETED)
         self._jobs -= len(done)
         logger.debug(f"Tasks finished: {len(done)}")
         # ensure pending + unqueued tasks persist
@@ -120,9 +120,7 @@ class RemoteRESTMessenger(Messenger):
         r = requests.post(
             kwargs["post_url"],
             json=message,
-            auth=kwargs["auth"]()
-            if getattr(kwargs["auth"], "__call__", None)
-            else kwargs["auth"],
+            auth=kwargs["auth"]() if callable(kwargs["auth"]) else kwargs["auth"],
         )
         return r.status_code
 